@@ -10,6 +10,7 @@ from werkzeug.wrappers import Request, Response
 import settings
 from callbacks import register_callbacks
 from layout import get_layout
+from prefork import enable_shared_state, preload_datasets, resolve_preload_paths, serve_prefork
 
 
 def load_config(ctx, param, config):
@@ -57,6 +58,8 @@ def main(config_data: dict | None = None):
     ip = os.getenv("DATASCOPE_IP", settings.DEFAULT_IP)
     port = str(os.getenv("DATASCOPE_PORT", settings.DEFAULT_PORT))
     debug = os.getenv("DATASCOPE_DEBUG", "True") == "True"
+    workers = int(os.getenv("DATASCOPE_WORKERS", settings.DEFAULT_WORKERS))
+    preload = [path for path in os.getenv("DATASCOPE_PRELOAD", settings.DEFAULT_PRELOAD).split(os.pathsep) if path]
 
     # Get token from environment variable and wrap app with middleware if token is set
     token = os.getenv("DATASCOPE_TOKEN", settings.DATASCOPE_TOKEN)  # Get from env var or use default(which is randomly generated at startup)
@@ -70,9 +73,18 @@ def main(config_data: dict | None = None):
 
     app.logger.disabled = True   # <-- kills "Dash is running on ..."
     app.layout = get_layout({})
-    register_callbacks(app) # Register callbacks
-
-    app.run(host=ip, port=port, debug=debug)
+    if workers > 1:
+        enable_shared_state(app)  # Session state must be visible to every worker process
+    register_callbacks(app, start_reaper=workers <= 1) # Register callbacks; forked workers start their own reaper
+    preload = resolve_preload_paths(preload, os.getenv("DATASCOPE_RDS_PATH", settings.DEFAULT_RDS_PATH))
+
+    if workers > 1:
+        if debug:
+            logging.warning("Debug mode is not available with several worker processes; serving without it.")
+        serve_prefork(app, ip, int(port), workers, preload)  # Each worker opens the preloads after the fork
+    else:
+        preload_datasets(app, preload)
+        app.run(host=ip, port=port, debug=debug)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
-import io
+import hashlib
 import logging
 import os
 import re
+import tempfile
+import threading
 import time
 import uuid
 import zipfile
@@ -9,26 +11,41 @@ from datetime import datetime
 from pathlib import Path
 
 import dash_bootstrap_components as dbc
-import plotly.io as pio
+import numpy as np
 import yaml
 from dash import ALL, Input, Output, State, ctx, dcc, html, no_update
 from dash.dcc.express import send_bytes, send_string
+from flask import jsonify
 
 import settings
 from data_loader import load_seurat_rds, remove_seurat_handle
+from dataset_cache import dataset_cache_key
+from dataset_registry import DatasetRegistry
+from export_pool import EXPORT_FORMATS, render, render_all
 from helpers import (
+    cluster_heatmap,
+    expression_cache,
+    fetch_expression_group_means_zscores,
     fetch_expression_subset,
     fetch_expression_subset_zscores,
+    figure_cache,
     filter_from_metadata,
     generate_boxplot,
+    generate_boxplot_summary,
     generate_heatmap,
     generate_umap,
+    generate_umap_density,
+    generate_umap_gl,
     generate_violin,
+    generate_violin_summary,
+    leaf_order_cache,
     limit_heatmap_inputs,
     parse_upload,
     scan_files,
 )
 from layout import FILTER_GRID_STYLE, make_filter_component
+from load_jobs import LoadJobManager
+from r_workers import r_pool_snapshot
 from state_store import AppStateStore
 
 # Activate logging
@@ -79,12 +96,15 @@ def _resolve_config_genes(config_genes, seurat_data):
     return resolved_genes
 
 
+def _with_selected(gene_ids, selected_genes):
+    """gene_ids followed by the selected genes not among them, so the selector can still label every selected gene."""
+    shown = set(gene_ids)
+    return list(gene_ids) + [gene for gene in selected_genes if gene not in shown]
+
+
 def _figure_title(fig):
-    layout_dict = fig.to_dict().get("layout", {})
-    title_value = layout_dict.get("title", "plot")
-    if isinstance(title_value, dict):
-        title_value = title_value.get("text", "plot")
-    return str(title_value).strip() or "plot"
+    title_value = fig.layout.title.text  # Read straight from the layout; no full-figure copy
+    return str(title_value or "").strip() or "plot"
 
 
 def _safe_filename(value, default="plot"):
@@ -94,77 +114,443 @@ def _safe_filename(value, default="plot"):
 
 
 def _serialize_figure(fig):
+    # The figure object stays on the server for export; only the dcc.Graph sends it to the browser
     return {
         "title": _figure_title(fig),
-        "figure_json": fig.to_json(),
+        "figure": fig,
     }
 
 
-def _figure_json_to_svg_bytes(figure_json):
-    fig = pio.from_json(figure_json)
-    fig.update_layout(
-        template=None,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
+
+def _selection_column(seurat_data, selection_state, role):
+    """Metadata values of the selection's color or shape column for the selected cells, or None if unset."""
+    column = selection_state[role]
+    if not column:
+        return None
+    return seurat_data["metadata"][column].iloc[selection_state["cells"]]
+
+
+def _unload_dataset(data_dfs):
+    """Free everything held for an evicted dataset: its R handle or store, and everything cached for it."""
+    remove_seurat_handle(data_dfs["seurat_handle"])
+    expression_cache.drop_handle(data_dfs["seurat_handle"])
+    leaf_order_cache.drop_handle(data_dfs["seurat_handle"])
+    figure_cache.drop_handle(data_dfs["seurat_handle"])
+
+
+def _load_progress_alert(job):
+    return dbc.Alert(
+        [
+            html.Strong("Loading: "),
+            html.Code(job["path"]),
+            html.Br(),
+            f"{job['phase'].capitalize()}… ({job['elapsed']:.0f} s)",
+            dbc.Progress(value=job["percent"], striped=True, animated=True, style={"marginTop": "0.5rem"}),
+        ],
+        color="info",
+    )
+
+
+def acquire_dataset(datasets, dataset_id, file_path, progress=None, r_workers=None):
+    """
+    Take a reference to the shared dataset for file_path, loading it (or its cache) if nobody holds it yet.
+    r_workers overrides settings.R_WORKERS for where R loads run (see prefork.enable_shared_state).
+    """
+    return datasets.acquire(
+        dataset_id,
+        lambda load_progress: load_seurat_rds(
+            file_path, settings.DEFAULT_ASSAY, settings.DEFAULT_LAYER, progress=load_progress, r_workers=r_workers
+        ),
+        progress,
     )
-    return pio.to_image(fig, format="svg")
 
 
+def _selection_state(filter_index, filters, color_column, shape_column):
+    """
+    Selection state for (column, values) filters. A selection is just integer positions into the
+    dataset's cells (metadata rows and matrix columns) plus column names; color/shape values are
+    resolved from the dataset's metadata when a plot needs them (see _selection_column).
+    No filter values selected means all cells.
+    """
+    selected_cells = filter_index.select(filters)
+
+    # Content digest of the selection (cells and encoding columns), used to key cached plots
+    digest = hashlib.sha1(selected_cells.astype(np.int64).tobytes())
+    digest.update(repr((color_column, shape_column)).encode())
+    return {"cells": selected_cells, "color": color_column, "shape": shape_column, "digest": digest.hexdigest()}
 
-def register_callbacks(app):
+
+def _uses_heatmap_cluster(plot_type):
+    return (plot_type or "").startswith("heatmap")
+
+
+def _figure_cache_key(seurat_data, selection_state, plot_type, selected_genes, shape_column, heatmap_cluster):
+    return (
+        seurat_data["seurat_handle"],
+        plot_type,
+        tuple(selected_genes or ()),
+        selection_state["digest"],
+        shape_column,
+        tuple(heatmap_cluster or ()) if _uses_heatmap_cluster(plot_type) else (),  # Other plots ignore clustering
+    )
+
+
+def _build_plots(seurat_data, selection_state, plot_type, selected_genes, shape_column, heatmap_cluster, plot_figures, active_plot_figures):
+    """
+    Build the plots of plot_type for a non-empty selection, appending the Dash components to
+    plot_figures and the exportable figures to active_plot_figures. Returns an optional alert;
+    invalid inputs raise ValueError.
+    """
+    plot_alert = None
+    selected_cells = selection_state["cells"]
+    gene_labels = seurat_data.get("gene_labels", {})
+    if plot_type in ("boxplot", "boxplot_summary"):
+        """Generate boxplots for each selected gene. Either split by shape filter, or all in one stack."""
+        if not selected_genes:
+            raise ValueError("For Boxplots please select one or more features.")
+        elif len(selected_genes) > settings.max_features:
+            raise ValueError(f"For Boxplots please select no more than {settings.max_features} features.")
+        cell_metadata = seurat_data["metadata"].iloc[selected_cells]
+        # One round-trip for all genes; each figure only densifies its own row
+        expression = fetch_expression_subset(
+            seurat_data["seurat_handle"],
+            genes=selected_genes,
+            cells=selected_cells,
+        )
+        boxplot = generate_boxplot_summary if plot_type == "boxplot_summary" else generate_boxplot
+        for gene in selected_genes:
+            fig = boxplot(
+                expression,
+                cell_metadata,
+                gene,
+                shape_column,
+                gene_label=gene_labels.get(gene, gene),
+            )
+            plot_figures.append(
+                html.Div(
+                    dcc.Graph(
+                        figure=fig,
+                        style={"height": "100%", "width": "100%"},
+                        config={"responsive": True},
+                    ),
+                    style={
+                        "width": "49%",
+                        "height": "45vh",
+                        "minHeight": "350px",
+                        "flex": "0 0 auto",
+                        "display": "inline-block",
+                    },
+                )
+            )
+            active_plot_figures.append(_serialize_figure(fig))
+
+    elif plot_type in ("umap", "umap_gl", "umap_density"):
+        umap_df = seurat_data["umap"]
+        barcodes_color = _selection_column(seurat_data, selection_state, "color")
+        if plot_type == "umap_density":
+            fig = generate_umap_density(umap_df.iloc[selected_cells], color=barcodes_color)  # Shape has no binned equivalent
+        else:
+            barcodes_shape = _selection_column(seurat_data, selection_state, "shape")
+            umap_plot = generate_umap_gl if plot_type == "umap_gl" else generate_umap
+            fig = umap_plot(umap_df.iloc[selected_cells], color=barcodes_color, shape=barcodes_shape)
+        plot_figures.append(
+            html.Div(
+                dcc.Graph(
+                    figure=fig,
+                    style={"height": "100%", "width": "100%"},
+                    config={"responsive": True},
+                ),
+                style={
+                    "width": "100%",
+                    "height": "70vh",
+                    "minHeight": "500px",
+                    "flex": "0 0 auto",
+                },
+            )
+        )
+        active_plot_figures.append(_serialize_figure(fig))
+
+    elif plot_type in ("violin", "violin_summary"):
+        """Generate violin plots for each selected gene. Either split by shape filter, or all in one stack."""
+        expression = fetch_expression_subset(
+            seurat_data["seurat_handle"],
+            genes=selected_genes,
+            cells=selected_cells,
+        )
+        cell_metadata = seurat_data["metadata"].iloc[selected_cells]
+        violin_plot = generate_violin_summary if plot_type == "violin_summary" else generate_violin
+        fig = violin_plot(
+            expression,
+            selected_genes,
+            cell_metadata,
+            shape_column,
+            gene_labels=gene_labels,
+        )
+        plot_figures.append(
+            html.Div(
+                dcc.Graph(
+                    figure=fig,
+                    style={"height": "100%", "width": "100%"},
+                    config={"responsive": True},
+                ),
+                style={
+                    "width": "100%",
+                    "height": "70vh",
+                    "minHeight": "500px",
+                    "flex": "0 0 auto",
+                },
+            )
+        )
+        active_plot_figures.append(_serialize_figure(fig))
+
+    elif plot_type == "heatmap":
+        # Downsampled cells keep the proportions of the shape (or else color) groups
+        strata = _selection_column(seurat_data, selection_state, "shape" if selection_state["shape"] else "color")
+        (heatmap_genes, heatmap_cells, plot_alert) = limit_heatmap_inputs(
+            selected_genes=selected_genes,
+            selected_cells=selected_cells,
+            all_genes=seurat_data["genes"],
+            n_cells=len(seurat_data["cells"]),
+            strata=strata,
+        )
+        heatmap_df = fetch_expression_subset_zscores(
+            seurat_data["seurat_handle"],
+            genes=heatmap_genes,
+            cells=heatmap_cells,
+        )
+        if heatmap_cluster:
+            heatmap_df = cluster_heatmap(
+                seurat_data["seurat_handle"],
+                heatmap_df,
+                heatmap_cells,
+                rows="rows" in heatmap_cluster,
+                columns="columns" in heatmap_cluster,
+            )
+        fig = generate_heatmap(
+            heatmap_df,
+            gene_labels=gene_labels,
+        )
+        plot_figures.append(
+            html.Div(
+                dcc.Graph(
+                    figure=fig,
+                    style={"height": "100%", "width": "100%"},
+                    config={"responsive": True},
+                ),
+                style={
+                    "width": "100%",
+                    "height": "70vh",
+                    "minHeight": "500px",
+                    "flex": "0 0 auto",
+                },
+            )
+        )
+        active_plot_figures.append(_serialize_figure(fig))
+
+    elif plot_type == "heatmap_pseudobulk":
+        """Aggregate every selected cell by the shape column (or else the color column); no cell sampling."""
+        metadata = seurat_data["metadata"]
+        if shape_column and shape_column in metadata.columns:
+            group_column = shape_column
+        elif selection_state["color"] in metadata.columns:
+            group_column = selection_state["color"]
+        else:
+            raise ValueError("For pseudobulk heatmaps please select a shape or color column to group cells by.")
+        (heatmap_genes, heatmap_cells, plot_alert) = limit_heatmap_inputs(
+            selected_genes=selected_genes,
+            selected_cells=selected_cells,
+            all_genes=seurat_data["genes"],
+            n_cells=len(seurat_data["cells"]),
+            max_cells=len(selected_cells),
+        )
+        heatmap_df = fetch_expression_group_means_zscores(
+            seurat_data["seurat_handle"],
+            genes=heatmap_genes,
+            cells=heatmap_cells,
+            groups=metadata[group_column].iloc[heatmap_cells],
+        )
+        if heatmap_cluster:
+            heatmap_df = cluster_heatmap(
+                seurat_data["seurat_handle"],
+                heatmap_df,
+                heatmap_cells,
+                rows="rows" in heatmap_cluster,
+                columns="columns" in heatmap_cluster,
+                group_by=group_column,
+            )
+        fig = generate_heatmap(
+            heatmap_df,
+            gene_labels=gene_labels,
+            title=f"Pseudobulk Heatmap ({len(heatmap_cells):,} cells by {group_column})",
+            x_label=group_column,
+        )
+        plot_figures.append(
+            html.Div(
+                dcc.Graph(
+                    figure=fig,
+                    style={"height": "100%", "width": "100%"},
+                    config={"responsive": True},
+                ),
+                style={
+                    "width": "100%",
+                    "height": "70vh",
+                    "minHeight": "500px",
+                    "flex": "0 0 auto",
+                },
+            )
+        )
+        active_plot_figures.append(_serialize_figure(fig))
+
+    else:
+        raise ValueError("Something went wrong?")
+    return plot_alert
+
+
+def start_state_reaper(app):
+    """
+    Free what closed tabs left behind: expired session state releases its dataset, long-idle datasets are unloaded.
+    Runs once per server process (for multi-process serving, in each worker after the fork).
+    """
+    if hasattr(app.server, "state_reaper"):
+        return app.server.state_reaper
+    state, datasets, load_jobs = app.server.app_state, app.server.datasets, app.server.load_jobs
+    ttl = settings.SESSION_TTL_MIN * 60
+
+    def reap():
+        while True:
+            time.sleep(settings.state_reaper_interval_s)
+            try:
+                expired = state.expire(ttl)
+                for dataset in expired:
+                    datasets.release(dataset["dataset_id"])
+                discarded = load_jobs.expire(ttl)
+                evicted = datasets.expire_idle(ttl)
+                if expired or discarded or evicted:
+                    logger.info(f"Expired {len(expired)} session datasets and {discarded} uncollected loads; unloaded {evicted} idle datasets")
+            except Exception:
+                logger.exception("Session state reaper failed")
+
+    app.server.state_reaper = threading.Thread(target=reap, name="state-reaper", daemon=True)
+    app.server.state_reaper.start()
+    return app.server.state_reaper
+
+
+def _register_state_resolvers(state, datasets, r_workers):
+    """How a server process rebuilds session state another process created (multi-process serving, see prefork.py)."""
+
+    def resolve_dataset(record):
+        return acquire_dataset(datasets, record["dataset_id"], record["file_path"], r_workers=r_workers)
+
+    def resolve_selection(record):
+        seurat_data = state.get_dataset(record["dataset_key"])
+        if seurat_data is None:
+            return None
+        return _selection_state(seurat_data["filter_index"], record["filters"], record["color"], record["shape"])
+
+    def resolve_figures(record):
+        # Only needed when an export lands on another process than the one that built the plots
+        seurat_data = state.get_dataset(record["dataset_key"])
+        selection_state = state.get_selection(record["selection_key"])
+        if seurat_data is None or selection_state is None or len(selection_state["cells"]) == 0:
+            return None
+        inputs = (record["plot_type"], record["genes"], record["shape_column"], record["heatmap_cluster"])
+        figure_cache_key = _figure_cache_key(seurat_data, selection_state, *inputs)
+        cached = figure_cache.get(figure_cache_key)
+        if cached is not None:
+            return cached[2]
+        plot_figures, active_plot_figures = [], []
+        try:
+            plot_alert = _build_plots(seurat_data, selection_state, *inputs, plot_figures, active_plot_figures)
+        except (ValueError, TypeError):
+            return None
+        figure_cache.put(figure_cache_key, (plot_figures, plot_alert, active_plot_figures))
+        return active_plot_figures
+
+    state.set_resolver("dataset", resolve_dataset)
+    state.set_resolver("selection", resolve_selection)
+    state.set_resolver("figures", resolve_figures)
+
+
+def register_callbacks(app, start_reaper=True):
+    shared = getattr(app.server, "shared_records", None)  # Set for multi-process serving, see prefork.py
+    r_workers = getattr(app.server, "r_workers", None)  # Likewise; None means settings.R_WORKERS
+    if not hasattr(app.server, "datasets"):
+        app.server.datasets = DatasetRegistry(
+            settings.DATASET_MEMORY_BUDGET_MB * 1_048_576,
+            evict=_unload_dataset,
+        )
+    datasets = app.server.datasets
     if not hasattr(app.server, "app_state"):
-        app.server.app_state = AppStateStore()
+        app.server.app_state = AppStateStore(shared)
     state = app.server.app_state
+    if shared is not None:
+        _register_state_resolvers(state, datasets, r_workers)
+    if not hasattr(app.server, "load_jobs"):
+        app.server.load_jobs = LoadJobManager(
+            shared, resolve=lambda info: acquire_dataset(datasets, info["dataset_id"], info["path"], r_workers=r_workers)
+        )
+    load_jobs = app.server.load_jobs
+    if start_reaper:
+        start_state_reaper(app)
 
     @app.callback(
         Output("download-plot", "data"),
         Input("download-svg-btn", "n_clicks"),
         State("active-plot-figures", "data"),
+        State("export-formats", "value"),
         prevent_initial_call=True,
     )
-    def download_plot(n_clicks, active_plot_figures):
+    def download_plot(n_clicks, figures_key, export_formats):
+        active_plot_figures = state.get_figures(figures_key)
         if not n_clicks or not active_plot_figures:
             return None
 
         ts = datetime.now().strftime("%Y%m%d-%H%M%S")
+        formats = [fmt for fmt in EXPORT_FORMATS if fmt in (export_formats or [])] or ["svg"]
 
-        if len(active_plot_figures) == 1:
+        if len(active_plot_figures) == 1 and len(formats) == 1:
             plot_spec = active_plot_figures[0]
             title = _safe_filename(plot_spec.get("title"), "plot")
-            filename = f"{title}_{ts}.svg"
-            svg_bytes = _figure_json_to_svg_bytes(plot_spec["figure_json"])
-            return send_bytes(svg_bytes, filename=filename)
+            filename = f"{title}_{ts}.{formats[0]}"
+            image_bytes = render(plot_spec["figure"].to_json(), formats[0])  # On the warm renderer pool
+            return send_bytes(image_bytes, filename=filename)
 
-        zip_buffer = io.BytesIO()
+        # Name every file up front; the renderer pool finishes them in any order
+        jobs = []
         used_names = set()
-        with zipfile.ZipFile(zip_buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-            for index, plot_spec in enumerate(active_plot_figures, start=1):
-                title = _safe_filename(plot_spec.get("title"), f"plot_{index:02d}")
-                base_name = f"{index:02d}_{title}"
-                filename = f"{base_name}.svg"
+        for index, plot_spec in enumerate(active_plot_figures, start=1):
+            title = _safe_filename(plot_spec.get("title"), f"plot_{index:02d}")
+            base_name = f"{index:02d}_{title}"
+            figure_json = plot_spec["figure"].to_json()  # Serialized once, shared by all formats
+            for fmt in formats:
+                filename = f"{base_name}.{fmt}"
                 suffix = 2
                 while filename in used_names:
-                    filename = f"{base_name}_{suffix}.svg"
+                    filename = f"{base_name}_{suffix}.{fmt}"
                     suffix += 1
                 used_names.add(filename)
-                zip_file.writestr(filename, _figure_json_to_svg_bytes(plot_spec["figure_json"]))
+                jobs.append((filename, figure_json, fmt))
 
-        return send_bytes(zip_buffer.getvalue(), filename=f"plots_{ts}.zip")
+        # The archive goes to a temporary file, so only the image being written is held in memory
+        with tempfile.TemporaryDirectory(prefix="datascope-export-") as tmp_dir:
+            zip_path = Path(tmp_dir) / f"plots_{ts}.zip"
+            with zipfile.ZipFile(zip_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+                for filename, image_bytes in render_all(jobs):  # Written as each figure completes
+                    zip_file.writestr(filename, image_bytes)
+            return dcc.send_file(str(zip_path))
 
     @app.callback(
-        Output("dataset-key", "data"),
-        Output("filter-schema-store", "data"),
-        Output("plot-selector", "disabled"),
+        Output("load-job-id", "data"),
+        Output("load-poll", "disabled"),
         Output("load-message", "children"),
         Input("file-dropdown", "value"),
-        State("dataset-key", "data"),
-        State("cell-index-key", "data"),
+        State("load-job-id", "data"),
         prevent_initial_call=True,
     )
-    def handle_file_selection(rel_value, current_dataset_state_key, current_selection_key):
+    def handle_file_selection(rel_value, current_job_id):
         """
-        Load the selected Seurat file, persist its server-side dataset state,
-        and update the browser with a new opaque dataset-state key.
+        Start loading the selected Seurat file in the background and begin polling
+        it. A load still running for a previous selection is cancelled.
         """
         if not rel_value:
             return no_update  # If no file selected, do nothing
@@ -172,18 +558,57 @@ def register_callbacks(app):
         abs_path = (str_path / rel_value).resolve()
         if not str(abs_path).startswith(str(str_path)):  # prevent path traversal
             raise ValueError(f"Invalid path selection - {abs_path}")
+        load_jobs.cancel(current_job_id)  # Superseded by this selection
+        try:
+            dataset_id = dataset_cache_key(abs_path, settings.DEFAULT_ASSAY, settings.DEFAULT_LAYER)  # Identity shared by every session opening this file
+        except OSError as e:
+            return no_update, no_update, dbc.Alert(f"Failed to load: {e}", color="danger", dismissable=True)
+        job_id = load_jobs.start(
+            lambda progress: acquire_dataset(datasets, dataset_id, abs_path, progress, r_workers),  # Don't send the result to the browser
+            on_discard=lambda data_dfs: datasets.release(data_dfs["dataset_id"]),
+            path=str(abs_path),
+            dataset_id=dataset_id,
+        )
+        return job_id, False, _load_progress_alert(load_jobs.status(job_id))
+
+    @app.callback(
+        Output("dataset-key", "data"),
+        Output("filter-schema-store", "data"),
+        Output("plot-selector", "disabled"),
+        Output("load-message", "children", allow_duplicate=True),
+        Output("load-poll", "disabled", allow_duplicate=True),
+        Input("load-poll", "n_intervals"),
+        State("load-job-id", "data"),
+        State("dataset-key", "data"),
+        State("cell-index-key", "data"),
+        prevent_initial_call=True,
+    )
+    def poll_dataset_load(_n_intervals, job_id, current_dataset_state_key, current_selection_key):
+        """
+        Report progress of the background load and, once it is done, persist its
+        server-side dataset state and update the browser with a new opaque
+        dataset-state key.
+        """
+        job = load_jobs.status(job_id)
+        if job is None:
+            return no_update, no_update, no_update, no_update, True
+        if job["status"] == "running":
+            return no_update, no_update, no_update, _load_progress_alert(job), False
+        if job["status"] == "failed":
+            load_jobs.pop_result(job_id)
+            return no_update, no_update, no_update, dbc.Alert(f"Failed to load: {job['error']}", color="danger", dismissable=True), True
+
+        data_dfs = load_jobs.pop_result(job_id)
+        abs_path = Path(job["path"])
         dataset_state_key = str(uuid.uuid4())  # opaque key for the server-side dataset state
-        # Keep Python-native dataset state in the server-side state store while the R registry
-        # owns the expression matrix for lazy subsetting.
+        # The session state store references the shared, refcounted dataset while the R registry
+        # (or the memory-mapped expression store) owns the expression matrix for lazy subsetting.
         try:
             st = abs_path.stat()
-            data_dfs = load_seurat_rds(abs_path)  # Don't send this object to the browser
-            previous_dataset = state.get_dataset(current_dataset_state_key)
-            previous_handle = previous_dataset.get("seurat_handle") if previous_dataset else None
-            if previous_handle and previous_handle != data_dfs["seurat_handle"]:
-                remove_seurat_handle(previous_handle)
             if current_dataset_state_key:
-                state.delete_dataset(current_dataset_state_key)
+                previous_dataset = state.delete_dataset(current_dataset_state_key)
+                if previous_dataset:
+                    datasets.release(previous_dataset["dataset_id"])  # Shared: only evicted once idle and over budget
             if current_selection_key:
                 state.delete_selection(current_selection_key)
             state.put_dataset(dataset_state_key, data_dfs)
@@ -197,14 +622,16 @@ def register_callbacks(app):
                         html.Strong("Loaded: "),
                         html.Code(str(abs_path)),
                         html.Br(),
-                        f"Size: {st.st_size / 1_048_576:.2f} MB · Modified: {time.ctime(st.st_mtime)}",
+                        f"Size: {st.st_size / 1_048_576:.2f} MB · Modified: {time.ctime(st.st_mtime)} · Load time: {job['elapsed']:.1f} s",
                     ],
                     color="success",
                     dismissable=True,
                 ),
+                True,
             )
         except Exception as e:
-            return no_update, no_update, no_update, dbc.Alert(f"Failed to load: {e}", color="danger", dismissable=True)
+            datasets.release(data_dfs["dataset_id"])
+            return no_update, no_update, no_update, dbc.Alert(f"Failed to load: {e}", color="danger", dismissable=True), True
 
     @app.callback(
         Output("file-list", "data"),
@@ -375,12 +802,18 @@ def register_callbacks(app):
         Input("cell-index-key", "data"),
         Input("shape-column-name", "data"),
         Input("dataset-key", "data"),
+        Input("heatmap-cluster", "value"),
+        State("active-plot-figures", "data"),
         prevent_initial_call=True,
     )
-    def update_plots(plot_type, selected_genes, selection_key, shape_column, dataset_state_key):
+    def update_plots(plot_type, selected_genes, selection_key, shape_column, dataset_state_key, heatmap_cluster, current_figures_key):
+        if ctx.triggered_id == "heatmap-cluster" and not _uses_heatmap_cluster(plot_type):
+            return no_update, no_update, no_update, no_update
+
         plot_figures = []
         active_plot_figures = []
         plot_alert = None
+        state.delete_figures(current_figures_key)  # The previous plots are replaced either way
 
         seurat_data = state.get_dataset(dataset_state_key)
         selection_state = state.get_selection(selection_key)
@@ -390,156 +823,58 @@ def register_callbacks(app):
                 "No data loaded. Please (re-)load the dataset.",
                 color="danger",
                 dismissable=True,
-            ), [], None
-
+            ), None, None
+
+        # Identical inputs (e.g. flipping back to a plot type) reuse the plots built before
+        figure_cache_key = _figure_cache_key(seurat_data, selection_state, plot_type, selected_genes, shape_column, heatmap_cluster)
+        # What other server processes need to rebuild these figures for an export (see resolve_figures)
+        plot_inputs = {
+            "dataset_key": dataset_state_key,
+            "selection_key": selection_key,
+            "plot_type": plot_type,
+            "genes": list(selected_genes or []),
+            "shape_column": shape_column,
+            "heatmap_cluster": list(heatmap_cluster or []),
+        }
+        cached = figure_cache.get(figure_cache_key)
+        if cached is not None:
+            plot_figures, plot_alert, active_plot_figures = cached
+            figures_key = str(uuid.uuid4())  # opaque key for the server-side figures used by export
+            state.put_figures(figures_key, active_plot_figures, plot_inputs)
+            return plot_figures, plot_alert, figures_key, None
+
+        selected_cells = selection_state["cells"]
+        if len(selected_cells) == 0:
+            return (
+                [],
+                dbc.Alert(
+                    "No cells match the current filters. Adjust one or more barcode filters to continue.",
+                    color="warning",
+                    dismissable=True,
+                ),
+                None,
+                None,
+            )
         try:
-            selected_cells = selection_state["cells"]
-            barcodes_color = selection_state["color"]
-            barcodes_shape = selection_state["shape"]
-            gene_labels = seurat_data.get("gene_labels", {})
-            if not selected_cells:
-                return (
-                    [],
-                    dbc.Alert(
-                        "No cells match the current filters. Adjust one or more barcode filters to continue.",
-                        color="warning",
-                        dismissable=True,
-                    ),
-                    [],
-                    None,
-                )
-            if plot_type == "boxplot":
-                """Generate boxplots for each selected gene. Either split by shape filter, or all in one stack."""
-                if not selected_genes:
-                    raise ValueError("For Boxplots please select one or more features.")
-                elif len(selected_genes) > settings.max_features:
-                    raise ValueError(f"For Boxplots please select no more than {settings.max_features} features.")
-                cell_metadata = seurat_data["metadata"].loc[selected_cells]
-                for gene in selected_genes:
-                    expression_df = fetch_expression_subset(
-                        seurat_data["seurat_handle"],
-                        genes=[gene],
-                        cells=selected_cells,
-                    )
-                    fig = generate_boxplot(
-                        expression_df,
-                        cell_metadata,
-                        gene,
-                        shape_column,
-                        gene_label=gene_labels.get(gene, gene),
-                    )
-                    plot_figures.append(
-                        html.Div(
-                            dcc.Graph(
-                                figure=fig,
-                                style={"height": "100%", "width": "100%"},
-                                config={"responsive": True},
-                            ),
-                            style={
-                                "width": "49%",
-                                "height": "45vh",
-                                "minHeight": "350px",
-                                "flex": "0 0 auto",
-                                "display": "inline-block",
-                            },
-                        )
-                    )
-                    active_plot_figures.append(_serialize_figure(fig))
-
-            elif plot_type == "umap":
-                umap_df = seurat_data["umap"]
-                fig = generate_umap(umap_df.loc[selected_cells], color=barcodes_color, shape=barcodes_shape)
-                plot_figures.append(
-                    html.Div(
-                        dcc.Graph(
-                            figure=fig,
-                            style={"height": "100%", "width": "100%"},
-                            config={"responsive": True},
-                        ),
-                        style={
-                            "width": "100%",
-                            "height": "70vh",
-                            "minHeight": "500px",
-                            "flex": "0 0 auto",
-                        },
-                    )
-                )
-                active_plot_figures.append(_serialize_figure(fig))
-
-            elif plot_type == "violin":
-                """Generate violin plots for each selected gene. Either split by shape filter, or all in one stack."""
-                violin_df = fetch_expression_subset(
-                    seurat_data["seurat_handle"],
-                    genes=selected_genes,
-                    cells=selected_cells,
-                )
-                cell_metadata = seurat_data["metadata"].loc[selected_cells]
-                fig = generate_violin(
-                    violin_df,
-                    selected_genes,
-                    cell_metadata,
-                    shape_column,
-                    gene_labels=gene_labels,
-                )
-                plot_figures.append(
-                    html.Div(
-                        dcc.Graph(
-                            figure=fig,
-                            style={"height": "100%", "width": "100%"},
-                            config={"responsive": True},
-                        ),
-                        style={
-                            "width": "100%",
-                            "height": "70vh",
-                            "minHeight": "500px",
-                            "flex": "0 0 auto",
-                        },
-                    )
-                )
-                active_plot_figures.append(_serialize_figure(fig))
-
-            elif plot_type == "heatmap":
-                (heatmap_genes, heatmap_cells, plot_alert) = limit_heatmap_inputs(
-                    selected_genes=selected_genes,
-                    selected_cells=selected_cells,
-                    all_genes=seurat_data["genes"],
-                    all_cells=seurat_data["cells"],
-                )
-                heatmap_df = fetch_expression_subset_zscores(
-                    seurat_data["seurat_handle"],
-                    genes=heatmap_genes,
-                    cells=heatmap_cells,
-                )
-                fig = generate_heatmap(
-                    heatmap_df,
-                    gene_labels=gene_labels,
-                )
-                plot_figures.append(
-                    html.Div(
-                        dcc.Graph(
-                            figure=fig,
-                            style={"height": "100%", "width": "100%"},
-                            config={"responsive": True},
-                        ),
-                        style={
-                            "width": "100%",
-                            "height": "70vh",
-                            "minHeight": "500px",
-                            "flex": "0 0 auto",
-                        },
-                    )
-                )
-                active_plot_figures.append(_serialize_figure(fig))
-
-            else:
-                raise ValueError("Something went wrong?")
-
+            plot_alert = _build_plots(
+                seurat_data,
+                selection_state,
+                plot_type,
+                selected_genes,
+                shape_column,
+                heatmap_cluster,
+                plot_figures,
+                active_plot_figures,
+            )
         except ValueError as e:
-            return plot_figures, dbc.Alert(f"Error: {e}", color="danger", dismissable=True), [], None
+            return plot_figures, dbc.Alert(f"Error: {e}", color="danger", dismissable=True), None, None
         except TypeError as e:
-            return plot_figures, dbc.Alert(f"Error: {str(e)}", color="danger", dismissable=True), [], None
+            return plot_figures, dbc.Alert(f"Error: {str(e)}", color="danger", dismissable=True), None, None
 
-        return plot_figures, plot_alert, active_plot_figures, None
+        figure_cache.put(figure_cache_key, (plot_figures, plot_alert, active_plot_figures))
+        figures_key = str(uuid.uuid4())  # opaque key for the server-side figures used by export
+        state.put_figures(figures_key, active_plot_figures, plot_inputs)
+        return plot_figures, plot_alert, figures_key, None
 
     @app.callback(
         Output("plot-status-store", "data", allow_duplicate=True),
@@ -549,11 +884,14 @@ def register_callbacks(app):
         Input("shape-column-name", "data"),
         Input("dataset-key", "data"),
         Input("cell-index-key", "data"),
+        Input("heatmap-cluster", "value"),
         prevent_initial_call=True,
     )
-    def mark_plot_update_pending(_filter_values, _plot_type, _selected_genes, _shape_column, dataset_state_key, selection_key):
+    def mark_plot_update_pending(_filter_values, plot_type, _selected_genes, _shape_column, dataset_state_key, selection_key, _heatmap_cluster):
         if not dataset_state_key or not selection_key:
             return None
+        if ctx.triggered_id == "heatmap-cluster" and not _uses_heatmap_cluster(plot_type):
+            return no_update  # update_plots ignores clustering for this plot
 
         return {"kind": "loading"}
 
@@ -575,7 +913,36 @@ def register_callbacks(app):
 
         return None
 
+    @app.callback(
+        Input("session-heartbeat", "n_intervals"),
+        State("dataset-key", "data"),
+        State("cell-index-key", "data"),
+        State("active-plot-figures", "data"),
+        prevent_initial_call=True,
+    )
+    def keep_session_alive(_n_intervals, dataset_state_key, selection_key, figures_key):
+        """Open tabs keep their server-side state from expiring; closed tabs stop calling in."""
+        state.touch(dataset_state_key, selection_key, figures_key)
+
     register_offcanvas_callbacks(app, state)
+    register_status_route(app, state, datasets, load_jobs)
+
+
+def register_status_route(app, state, datasets, load_jobs):
+    """JSON overview of what is resident in this server process (behind the same token as the app)."""
+
+    @app.server.route("/status")
+    def status():
+        return jsonify(
+            {
+                "sessions": state.snapshot(),
+                "datasets": datasets.snapshot(),
+                "load_jobs": load_jobs.snapshot(),
+                "expression_cache": expression_cache.snapshot(),
+                "r_workers": r_pool_snapshot(),
+                "session_ttl_minutes": settings.SESSION_TTL_MIN,
+            }
+        )
 
 
 def register_offcanvas_callbacks(app, state):
@@ -592,24 +959,39 @@ def register_offcanvas_callbacks(app, state):
         """
         Update the gene selector for the active dataset and apply any uploaded
         gene selections against the currently loaded server-side dataset state.
+        Only the first genes and the selected ones are sent; search_gene_options
+        fetches the rest as the user types.
         """
-        try:
-            seurat_data = state.get_dataset(dataset_state_key)
-            gene_names = seurat_data["genes"]
-            gene_labels = seurat_data.get("gene_labels", {})
-            gene_options = [{"label": gene_labels.get(gene, gene), "value": gene} for gene in gene_names]
-        except TypeError:
+        seurat_data = state.get_dataset(dataset_state_key)
+        if seurat_data is None:
             return no_update, no_update
+        gene_index = seurat_data["gene_index"]
 
         if config_data:
             config_genes = (config_data.get("genes") or {}).get("values", [])
             selected_genes = _resolve_config_genes(config_genes, seurat_data)
 
-        # Validate selected genes columns against gene_options (which may change if user re-loads dataset)
-        set_gene_options = set([opt["value"] for opt in gene_options])  # O(1) lookups
-        selected_genes = [x for x in (selected_genes or []) if x in set_gene_options]
+        # Validate selected genes against the dataset (which may change if user re-loads dataset)
+        available_genes = seurat_data["gene_symbols"]  # Keyed by gene ID: O(1) lookups
+        selected_genes = [x for x in (selected_genes or []) if x in available_genes]
 
-        return gene_options, selected_genes
+        return gene_index.options(_with_selected(gene_index.search("", settings.gene_search_results), selected_genes)), selected_genes
+
+    @app.callback(
+        Output("gene-selector", "options", allow_duplicate=True),
+        Input("gene-selector", "search_value"),
+        State("dataset-key", "data"),
+        State("gene-selector", "value"),
+        prevent_initial_call=True,
+    )
+    def search_gene_options(search_value, dataset_state_key, selected_genes):
+        """Replace the gene selector options with the best matches for what the user typed, keeping the selected genes."""
+        seurat_data = state.get_dataset(dataset_state_key)
+        if seurat_data is None:
+            return no_update
+        gene_index = seurat_data["gene_index"]
+        matches = gene_index.search(search_value, settings.gene_search_results)
+        return gene_index.options(_with_selected(matches, selected_genes or []))
 
     @app.callback(
         Output("cell-index-key", "data"),
@@ -623,8 +1005,7 @@ def register_offcanvas_callbacks(app, state):
     )
     def update_cell_selection(filters_cells, filters_ids, color_column, shape_column, dataset_state_key, schema, current_selection_key):
         try:
-            metadata_df = state.get_dataset(dataset_state_key)["metadata"]
-            selected_cells = metadata_df.index  # Default to all cell types
+            filter_index = state.get_dataset(dataset_state_key)["filter_index"]
         except TypeError:
             return no_update
 
@@ -635,18 +1016,14 @@ def register_offcanvas_callbacks(app, state):
         if shape_column not in schema_names:
             shape_column = None
 
-        for f, id_ in zip(filters_cells, filters_ids, strict=True):
-            if not f:
-                continue
-            selected_indices = metadata_df.index[metadata_df[id_["name"]].isin(f)]
-            selected_cells = selected_cells.intersection(selected_indices)
-            if selected_cells.empty:
-                break
-        color_barcodes = metadata_df.loc[selected_cells, color_column] if color_column else None  # Series or None
-        shape_barcodes = metadata_df.loc[selected_cells, shape_column] if shape_column else None  # Series or None
-
+        filters = [(id_["name"], f) for f, id_ in zip(filters_cells, filters_ids, strict=True)]
         selection_key = str(uuid.uuid4())  # opaque key for the server-side selection state
-        state.put_selection(selection_key, {"cells": list(selected_cells), "color": color_barcodes, "shape": shape_barcodes})
+        state.put_selection(
+            selection_key,
+            _selection_state(filter_index, filters, color_column, shape_column),
+            # Other server processes recompute the positions from the filters (see resolve_selection)
+            {"dataset_key": dataset_state_key, "filters": filters, "color": color_column, "shape": shape_column},
+        )
         if current_selection_key and current_selection_key != selection_key:
             state.delete_selection(current_selection_key)
 
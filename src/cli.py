@@ -4,7 +4,7 @@ from pathlib import Path
 import click
 
 from app import load_config, main
-from settings import DEFAULT_DEBUG, DEFAULT_IP, DEFAULT_PORT, DEFAULT_RDS_PATH
+from settings import DEFAULT_DEBUG, DEFAULT_IP, DEFAULT_PORT, DEFAULT_RDS_PATH, DEFAULT_WORKERS
 
 
 @click.command()
@@ -13,8 +13,10 @@ from settings import DEFAULT_DEBUG, DEFAULT_IP, DEFAULT_PORT, DEFAULT_RDS_PATH
 @click.option("--ip", default=DEFAULT_IP, help="IP address to run the Dash app on.")
 @click.option("--port", type=int, default=DEFAULT_PORT, help="Port number for the Dash app.")
 @click.option("-r", "--rds-path", type=str, default=DEFAULT_RDS_PATH, help="Path to RDS datafile containing one Seurat object.")
+@click.option("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Server processes; more than 1 pre-forks workers that share preloaded datasets.")
+@click.option("--preload", multiple=True, help="Dataset (relative to --rds-path) to load at startup; repeat for several.")
 @click.pass_context
-def cli(ctx, debug, ip, port, rds_path):
+def cli(ctx, debug, ip, port, rds_path, workers, preload):
     """Launch the Dash app with configurable IP, port, and debug mode."""
 
     # Set env vars from config file, then update with CLI args (CLI > config > defaults)
@@ -24,6 +26,9 @@ def cli(ctx, debug, ip, port, rds_path):
     os.environ["DATASCOPE_PORT"] = str(port)
     os.environ["DATASCOPE_DEBUG"] = str(debug)
     os.environ["DATASCOPE_RDS_PATH"] = str(Path(rds_path).resolve())
+    os.environ["DATASCOPE_WORKERS"] = str(workers)
+    if preload:
+        os.environ["DATASCOPE_PRELOAD"] = os.pathsep.join(preload)
 
     main()
 
@@ -1,12 +1,29 @@
+import logging
 import os
 from collections import Counter, defaultdict
+from collections.abc import Callable
+from threading import RLock
 
+import numpy as np
 import pandas as pd
 import rpy2.robjects as ro
+import scipy.sparse as sp
 from rpy2.robjects import pandas2ri
 from rpy2.robjects.conversion import localconverter
 from rpy2.robjects.packages import importr
 
+import settings
+from dataset_cache import read_dataset_cache, read_symbol_table, write_dataset_cache, write_symbol_table
+from expression_store import register_store, release_store
+from filter_index import CellFilterIndex
+from gene_index import GeneSearchIndex
+from r_workers import get_r_pool
+
+logger = logging.getLogger(__name__)
+
+# The embedded R is not thread-safe: every call into it from Python goes through this lock
+R_LOCK = RLock()
+
 # Load R packages
 try:
     importr("base")
@@ -19,89 +36,88 @@ except Exception as e:
 ro.r("""
     .seurat_registry <- new.env(parent = emptyenv())
 
-    infer_ensembl_species <- function(genes) {
-        if (length(genes) == 0) {
+    # Version of an installed package without loading it; NA if it is not installed
+    installed_package_version <- function(pkg) {
+        if (!nzchar(system.file(package = pkg))) {
             return(NA_character_)
         }
-
-        normalized <- sub("\\\\..*$", "", genes)
-        if (any(startsWith(normalized, "ENSMUS"), na.rm = TRUE)) {
-            return("mouse")
-        }
-        if (any(startsWith(normalized, "ENSRN"), na.rm = TRUE)) {
-            return("rat")
-        }
-        if (any(startsWith(normalized, "ENSG"), na.rm = TRUE)) {
-            return("human")
-        }
-
-        NA_character_
+        as.character(utils::packageVersion(pkg))
     }
 
-    map_ensembl_to_symbols <- function(genes) {
-        if (length(genes) == 0) {
-            return(rep(NA_character_, 0))
-        }
-
-        species <- infer_ensembl_species(genes)
-        if (is.na(species) || !requireNamespace("AnnotationDbi", quietly = TRUE)) {
-            return(rep(NA_character_, length(genes)))
-        }
-
-        org_pkg <- switch(
-            species,
-            human = "org.Hs.eg.db",
-            mouse = "org.Mm.eg.db",
-            rat = "org.Rn.eg.db",
-            NA_character_
-        )
-        if (is.na(org_pkg) || !requireNamespace(org_pkg, quietly = TRUE)) {
-            return(rep(NA_character_, length(genes)))
+    # Every Ensembl ID of an org.*.eg.db package with its first symbol. Only called when
+    # the package version is not in the on-disk symbol cache yet (see map_ensembl_to_symbols).
+    ensembl_symbol_table <- function(org_pkg) {
+        if (!requireNamespace("AnnotationDbi", quietly = TRUE) || !requireNamespace(org_pkg, quietly = TRUE)) {
+            return(NULL)
         }
 
-        normalized <- sub("\\\\..*$", "", genes)
         org_db <- getExportedValue(org_pkg, org_pkg)
+        ensembl <- AnnotationDbi::keys(org_db, keytype = "ENSEMBL")
         mapped <- AnnotationDbi::mapIds(
             org_db,
-            keys = unique(normalized),
+            keys = ensembl,
             column = "SYMBOL",
             keytype = "ENSEMBL",
             multiVals = "first"
         )
 
-        unname(mapped[normalized])
+        symbol <- unname(mapped[ensembl])
+        keep <- !is.na(symbol)
+        data.frame(ensembl = ensembl[keep], symbol = symbol[keep], stringsAsFactors = FALSE)
     }
 
-    register_seurat_matrix <- function(file_path, assay, layer) {
-        obj <- LoadSeuratRds(file_path)
-
-        mat <- LayerData(obj, assay = assay, layer = layer)
-        metadata <- obj@meta.data
-        umap <- as.data.frame(Embeddings(obj, reduction = "umap"))
-        genes <- rownames(mat)
-        gene_symbols <- map_ensembl_to_symbols(genes)
-        cells <- colnames(mat)
-
+    # Loading is split into stages so Python can report progress and cancel between them.
+    # Each stage works on the registry entry for handle; remove_seurat_matrix frees it at any point.
+    read_seurat_object <- function(file_path) {
         handle <- paste0(
             basename(file_path), "_",
             as.integer(Sys.time()), "_",
             sample.int(1e9, 1)
         )
 
-        .seurat_registry[[handle]] <- list(matrix = mat)
+        .seurat_registry[[handle]] <- list(object = LoadSeuratRds(file_path))
+        handle
+    }
 
+    extract_seurat_layer <- function(handle, assay, layer) {
+        obj <- .seurat_registry[[handle]]$object
+        if (is.null(obj)) {
+            stop("Unknown handle: ", handle)
+        }
+
+        .seurat_registry[[handle]] <- list(
+            matrix = LayerData(obj, assay = assay, layer = layer),
+            metadata = obj@meta.data,
+            umap = as.data.frame(Embeddings(obj, reduction = "umap"))
+        )
         rm(obj)
- 
+        invisible(gc())
+        invisible(TRUE)
+    }
+
+    seurat_gene_names <- function(handle) {
+        rownames(.seurat_registry[[handle]]$matrix)
+    }
+
+    collect_seurat_data <- function(handle) {
+        entry <- .seurat_registry[[handle]]
+        .seurat_registry[[handle]] <- list(matrix = entry$matrix)
+
         list(
-            handle = handle,
-            metadata = metadata,
-            umap = umap,
-            genes = genes,
-            gene_symbols = gene_symbols,
-            cells = colnames(mat)
+            metadata = entry$metadata,
+            umap = entry$umap,
+            genes = rownames(entry$matrix),
+            cells = colnames(entry$matrix),
+            nnz = if (methods::is(entry$matrix, "sparseMatrix")) as.double(length(entry$matrix@x)) else as.double(length(entry$matrix))
         )
     }
 
+    # Stored values the expression matrix has as a dgCMatrix (what get_expression_subset_matrix ships)
+    expression_nnz <- function(handle) {
+        mat <- .seurat_registry[[handle]]$matrix
+        if (inherits(mat, "dgCMatrix")) as.double(length(mat@x)) else as.double(sum(mat != 0))
+    }
+
     get_expression_subset_matrix <- function(handle, genes = NULL, cells = NULL) {
         entry <- .seurat_registry[[handle]]
         if (is.null(entry)) {
@@ -113,28 +129,25 @@ ro.r("""
             genes <- intersect(genes, rownames(mat))
             mat <- mat[genes, , drop = FALSE]
         }
-        if (!is.null(cells)) {
+        if (is.numeric(cells)) {
+            mat <- mat[, cells, drop = FALSE]  # 1-based column positions
+        } else if (!is.null(cells)) {
             cells <- intersect(cells, colnames(mat))
             mat <- mat[, cells, drop = FALSE]
         }
-     
-        bytes_needed <- as.double(nrow(mat)) * as.double(ncol(mat)) * 8
-        max_heatmap_bytes <- 5000 * 1024^2  # e.g. 5000 MB
-        if (bytes_needed > max_heatmap_bytes) {
-            stop(
-                sprintf(
-                    "Heatmap subset too large to materialize safely (%d x %d, ~%.1f MB dense). Refine filters or reduce genes/cells.",
-                    nrow(mat), ncol(mat), bytes_needed / 1024^2
-                )
-            )
+        if (!inherits(mat, "dgCMatrix")) {
+            mat <- methods::as(methods::as(mat, "CsparseMatrix"), "generalMatrix")
         }
-     
+
+        # Ship the CSC components instead of densifying with as.matrix(); the Python side
+        # rebuilds a scipy.sparse matrix and only densifies what it renders.
         list(
-            data = as.matrix(mat),
+            i = mat@i,
+            p = mat@p,
+            x = as.double(mat@x),
+            dims = dim(mat),
             genes = rownames(mat),
-            cells = colnames(mat),
-            nrow = nrow(mat),
-            ncol = ncol(mat)
+            cells = colnames(mat)
         )
     }
 
@@ -168,6 +181,75 @@ def _optimize_metadata_dtypes(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+# -------------------------------------------------------------------
+# Ensembl ID -> symbol mapping from per-species tables cached on disk (see dataset_cache.py).
+# R and AnnotationDbi are only needed the first time a package version is seen.
+ORG_PACKAGES = (("ENSMUS", "org.Mm.eg.db"), ("ENSRN", "org.Rn.eg.db"), ("ENSG", "org.Hs.eg.db"))  # Checked in this order
+
+_symbol_tables: dict[tuple[str, str], pd.Series | None] = {}
+_symbol_tables_lock = RLock()
+
+
+def _strip_ensembl_versions(genes: list[str]) -> pd.Index:
+    return pd.Index([str(gene).partition(".")[0] for gene in genes], dtype=object)
+
+
+def infer_org_package(ensembl_ids: pd.Index) -> str | None:
+    """The org.*.eg.db package for the species of the Ensembl IDs, or None if they are not Ensembl IDs."""
+    heads = {str(gene)[:6] for gene in ensembl_ids}  # A handful of distinct heads, whatever the gene count
+    for prefix, org_package in ORG_PACKAGES:
+        if any(head.startswith(prefix) for head in heads):
+            return org_package
+    return None
+
+
+def _symbol_table(org_package: str) -> pd.Series | None:
+    """Symbols indexed by Ensembl ID for the installed version of org_package, from the on-disk cache or built once in R."""
+    with R_LOCK:
+        version = ro.r["installed_package_version"](org_package)[0]  # type: ignore
+    if version is ro.NA_Character or not isinstance(version, str):
+        return None
+
+    with _symbol_tables_lock:
+        key = (org_package, version)
+        if key in _symbol_tables:
+            return _symbol_tables[key]
+
+        table = read_symbol_table(org_package, version)
+        if table is None:
+            with R_LOCK, localconverter(ro.default_converter + pandas2ri.converter):
+                table = ro.r["ensembl_symbol_table"](org_package)  # type: ignore
+            if isinstance(table, pd.DataFrame):
+                try:
+                    path = write_symbol_table(org_package, version, table)
+                    logger.info(f"Cached {len(table)} Ensembl symbols from {org_package} {version} in {path}")
+                except OSError as e:  # Still usable for this process
+                    logger.warning(f"Could not write symbol table for {org_package}: {e}")
+            else:
+                table = None
+
+        if table is not None:
+            table = table.dropna().drop_duplicates("ensembl")
+            table = pd.Series(table["symbol"].to_numpy(dtype=object), index=pd.Index(table["ensembl"], dtype=object))
+        _symbol_tables[key] = table
+        return table
+
+
+def map_ensembl_to_symbols(genes: list[str]) -> list[str | None]:
+    """Symbol for each gene that is a known Ensembl ID (version suffixes ignored), None for the others."""
+    if not genes:
+        return []
+    ensembl_ids = _strip_ensembl_versions(genes)
+    org_package = infer_org_package(ensembl_ids)
+    table = _symbol_table(org_package) if org_package else None
+    if table is None:
+        return [None] * len(genes)
+    positions = table.index.get_indexer(ensembl_ids)
+    symbols = np.where(positions >= 0, table.to_numpy()[positions], None)  # One vectorized lookup for all genes
+    return symbols.tolist()
+# -------------------------------------------------------------------
+
+
 def _build_gene_display_data(genes: list[str], gene_symbols: list[str]) -> tuple[dict[str, str], dict[str, str], dict[str, list[str]], dict[str, list[str]]]:
     resolved_symbols = []
     symbol_counts: Counter[str] = Counter()
@@ -194,39 +276,165 @@ def _build_gene_display_data(genes: list[str], gene_symbols: list[str]) -> tuple
     return gene_symbols_by_id, gene_labels, dict(gene_ids_by_symbol), dict(gene_ids_by_symbol_folded)
 
 
+# -------------------------------------------------------------------
+def r_expression_subset(handle: str, genes: list[str] | None = None, cells: np.ndarray | None = None):
+    """
+    Subset the matrix registered in R under handle and return (genes x cells CSR matrix, rownames, colnames).
+    cells are 0-based column positions; R indexes by position instead of matching barcode strings.
+    """
+    with R_LOCK, localconverter(ro.default_converter + pandas2ri.converter):
+        r_genes = ro.StrVector(genes) if genes else ro.NULL
+        # A contiguous int32 array is copied into the R integer vector as one buffer; a list or int64
+        # array would be converted one boxed Python int per cell
+        r_cells = ro.IntVector(np.ascontiguousarray(cells, dtype=np.int32) + np.int32(1)) if cells is not None else ro.NULL
+        res = ro.r["get_expression_subset_matrix"](handle, r_genes, r_cells)  # type: ignore
+
+    # Rebuild the dgCMatrix from its CSC components (i, p, x, dims)
+    n_rows, n_cols = (int(d) for d in res[3])
+    matrix = sp.csc_matrix(
+        (np.asarray(res[2], dtype=np.float64), np.asarray(res[0], dtype=np.int32), np.asarray(res[1], dtype=np.int32)),
+        shape=(n_rows, n_cols),
+    ).tocsr()
+    rownames = list(res[4]) if n_rows else []
+    colnames = list(res[5]) if n_cols else []
+
+    return (matrix, rownames, colnames)
+# -------------------------------------------------------------------
+
+
+def _expression_nnz(handle: str) -> int:
+    with R_LOCK:
+        return int(ro.r["expression_nnz"](handle)[0])  # type: ignore
+
+
 def remove_seurat_handle(handle: str | None) -> bool:
     if not handle:
         return False
 
+    if release_store(handle):
+        return True
+    pool = get_r_pool()
+    if pool is not None and pool.owns(handle):
+        return pool.remove(handle)
+
     try:
-        removed = ro.r["remove_seurat_matrix"](handle)  # type: ignore
+        with R_LOCK:
+            removed = ro.r["remove_seurat_matrix"](handle)  # type: ignore
     except Exception:
         return False
 
     return bool(removed[0])
 
-def load_seurat_rds(file_path: str | os.PathLike[str], assay="SCT", layer="data"):
+def _report(progress: Callable[[str], None] | None, phase: str) -> None:
+    if progress is not None:
+        progress(phase)  # May raise to cancel the load
+
+
+def load_seurat_rds(
+    file_path: str | os.PathLike[str],
+    assay="SCT",
+    layer="data",
+    progress: Callable[[str], None] | None = None,
+    r_workers: int | None = None,
+):
+    """
+    Load a Seurat object (or its on-disk cache) and return the Python-native dataset state.
+    progress, if given, is called with the name of each phase as it starts; raising from it
+    cancels the load and frees anything already registered in R. r_workers overrides
+    settings.R_WORKERS for starting the R worker pool (see r_workers.get_r_pool).
+    """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File {file_path} not found.")
 
-    with localconverter(ro.default_converter + pandas2ri.converter):
-        registry = ro.r["register_seurat_matrix"](str(file_path), assay, layer) # type: ignore
-
-        handle = str(registry.getbyname("handle")[0])
-        metadata_df = _optimize_metadata_dtypes(registry.getbyname("metadata"))
-        umap_df = registry.getbyname("umap")
-        umap_df.columns = umap_df.columns.str.upper()
-        genes = list(registry.getbyname("genes"))
-        gene_symbols = list(registry.getbyname("gene_symbols"))
-        cells = list(registry.getbyname("cells"))
-    del registry
+    cached = read_dataset_cache(file_path, assay, layer) if settings.DATASET_CACHE_ENABLED else None
+    pool = get_r_pool(r_workers)
+    if cached is None and pool is not None:
+        return pool.load(file_path, assay, layer, progress)  # Loaded (and pinned) in an R worker process
+    if cached is not None:
+        _report(progress, "reading cache")
+        # Unchanged file: everything comes from the on-disk cache and R is never touched
+        metadata_df = cached["metadata"]
+        umap_df = cached["umap"]
+        genes = cached["genes"]
+        gene_symbols = cached["gene_symbols"]
+        cells = cached["cells"]
+        handle = register_store(file_path, cached["cache_dir"], genes, cells)
+        matrix_bytes = 0  # Memory-mapped: lives in the (reclaimable) page cache
+        store_dir = cached["cache_dir"]
+    else:
+        handle = None
+        store_dir = None
+        try:
+            _report(progress, "reading RDS")
+            with R_LOCK:
+                handle = str(ro.r["read_seurat_object"](str(file_path))[0])  # type: ignore
+            _report(progress, "extracting layer")
+            with R_LOCK:
+                ro.r["extract_seurat_layer"](handle, assay, layer)  # type: ignore
+            _report(progress, "mapping symbols")
+            with R_LOCK:
+                gene_names = list(ro.r["seurat_gene_names"](handle))  # type: ignore
+            gene_symbols = map_ensembl_to_symbols(gene_names)
+            _report(progress, "converting metadata")
+            with R_LOCK, localconverter(ro.default_converter + pandas2ri.converter):
+                registry = ro.r["collect_seurat_data"](handle)  # type: ignore
+
+                metadata_df = _optimize_metadata_dtypes(registry.getbyname("metadata"))
+                umap_df = registry.getbyname("umap")
+                umap_df.columns = umap_df.columns.str.upper()
+                genes = list(registry.getbyname("genes"))
+                cells = list(registry.getbyname("cells"))
+                matrix_bytes = int(registry.getbyname("nnz")[0]) * 12  # double value + int row index per entry
+            del registry
+            if settings.DATASET_CACHE_ENABLED:
+                _report(progress, "writing cache")
+        except BaseException:
+            remove_seurat_handle(handle)  # Free whatever the cancelled or failed load registered
+            raise
+
+        if settings.DATASET_CACHE_ENABLED:
+            try:
+                cache_dir = write_dataset_cache(
+                    file_path,
+                    assay,
+                    layer,
+                    metadata=metadata_df,
+                    umap=umap_df,
+                    genes=genes,
+                    gene_symbols=gene_symbols,
+                    cells=cells,
+                    # Gene blocks straight from R, so Python never holds the whole matrix next to R's copy
+                    matrix_blocks=(
+                        r_expression_subset(handle, genes[start : start + settings.cache_write_block_genes])[0]
+                        for start in range(0, len(genes), settings.cache_write_block_genes)
+                    ),
+                    nnz=_expression_nnz(handle),
+                )
+                logger.info(f"Wrote dataset cache for {file_path} to {cache_dir}")
+                if settings.EXPRESSION_BACKEND == "mmap":
+                    # Serve expression from the memory-mapped rows and give the R copy back
+                    r_handle = handle
+                    handle = register_store(file_path, cache_dir, genes, cells)
+                    remove_seurat_handle(r_handle)
+                    matrix_bytes = 0
+                    store_dir = cache_dir
+            except Exception as e:  # The cache is an optimization; never fail a load over it
+                logger.warning(f"Could not write dataset cache for {file_path}: {e}")
+
+    # Selections are column positions, so metadata and UMAP rows must follow the matrix column order
+    cell_index = pd.Index(cells)
+    if not metadata_df.index.equals(cell_index):
+        metadata_df = metadata_df.reindex(cell_index)
+    if not umap_df.index.equals(cell_index):
+        umap_df = umap_df.reindex(cell_index)
 
     gene_symbols_by_id, gene_labels, gene_ids_by_symbol, gene_ids_by_symbol_folded = _build_gene_display_data(
         genes,
         gene_symbols,
     )
 
-    print(f"Loaded Seurat object from {file_path} with handle {handle}. Metadata shape: {metadata_df.shape}, UMAP shape: {umap_df.shape}")
+    source = "cache" if cached is not None else "R"
+    print(f"Loaded Seurat object from {file_path} ({source}) with handle {handle}. Metadata shape: {metadata_df.shape}, UMAP shape: {umap_df.shape}")
 
     return {
         "seurat_handle": handle,
@@ -235,7 +443,12 @@ def load_seurat_rds(file_path: str | os.PathLike[str], assay="SCT", layer="data"
         "gene_labels": gene_labels,
         "gene_ids_by_symbol": gene_ids_by_symbol,
         "gene_ids_by_symbol_folded": gene_ids_by_symbol_folded,
+        "gene_index": GeneSearchIndex(genes, gene_labels, gene_ids_by_symbol_folded),  # The gene selector queries it as the user types
         "cells": cells,
         "metadata": metadata_df,
+        "filter_index": CellFilterIndex(metadata_df),  # Built once; filters then only gather by category code
         "umap": umap_df,
+        "matrix_bytes": matrix_bytes,
+        "expression_store": str(store_dir) if store_dir else None,
+        "file_path": str(file_path),  # Lets another server process load the same dataset (see state_store.py)
     }
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2  # 2: expression values kept as float64, as R holds them
+_INDEX_COLUMN = "__datascope_index__"
+
+
+# -------------------------------------------------------------------
+# Cache identity: a dataset is only reused while its path, size and mtime are unchanged
+def dataset_cache_key(file_path: str | os.PathLike[str], assay: str, layer: str) -> str:
+    path = Path(file_path).resolve()
+    st = path.stat()
+    identity = f"{path}:{st.st_size}:{st.st_mtime_ns}:{assay}:{layer}:{CACHE_VERSION}"
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def dataset_cache_root(file_path: str | os.PathLike[str]) -> Path:
+    """Return the configured cache directory, or a hidden directory next to the dataset."""
+    if settings.DATASET_CACHE_DIR:
+        return Path(settings.DATASET_CACHE_DIR)
+    return Path(file_path).resolve().parent / ".datascope_cache"
+
+
+def dataset_cache_dir(file_path: str | os.PathLike[str], assay: str, layer: str) -> Path:
+    return dataset_cache_root(file_path) / f"{Path(file_path).stem}-{dataset_cache_key(file_path, assay, layer)}"
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Columnar frames: feather needs a default index, so the cell barcodes travel as a column
+def _write_frame(df: pd.DataFrame, path: Path) -> None:
+    out = df.copy()
+    out.columns = [str(c) for c in out.columns]
+    out.index = out.index.astype(str)
+    out.index.name = _INDEX_COLUMN
+    out.reset_index().to_feather(path)
+
+
+def _read_frame(path: Path) -> pd.DataFrame:
+    df = pd.read_feather(path).set_index(_INDEX_COLUMN)
+    df.index.name = None
+    return df
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+def read_dataset_cache(file_path: str | os.PathLike[str], assay: str, layer: str) -> dict | None:
+    """
+    Return the cached Python-native dataset for file_path, or None on a cache miss.
+    The expression matrix stays on disk; open it with expression_store.register_store.
+    """
+    cache_dir = dataset_cache_dir(file_path, assay, layer)
+    if not (cache_dir / "manifest.json").is_file():
+        return None
+
+    try:
+        manifest = json.loads((cache_dir / "manifest.json").read_text())
+        if manifest.get("version") != CACHE_VERSION:
+            return None
+        names = json.loads((cache_dir / "names.json").read_text())
+        if not all((cache_dir / name).is_file() for name in ("matrix_data.npy", "matrix_indices.npy", "matrix_indptr.npy")):
+            return None
+        return {
+            "metadata": _read_frame(cache_dir / "metadata.feather"),
+            "umap": _read_frame(cache_dir / "umap.feather"),
+            "genes": names["genes"],
+            "gene_symbols": names["gene_symbols"],
+            "cells": names["cells"],
+            "cache_dir": cache_dir,
+        }
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable dataset cache {cache_dir}: {e}")
+        return None
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+def _write_matrix(cache_dir: Path, matrix_blocks: Iterable[sp.spmatrix], shape: tuple[int, int], nnz: int) -> None:
+    """Write row blocks as the CSR arrays of a shape matrix straight into preallocated .npy files."""
+    data = np.lib.format.open_memmap(cache_dir / "matrix_data.npy", mode="w+", dtype=np.float64, shape=(nnz,))
+    indices = np.lib.format.open_memmap(cache_dir / "matrix_indices.npy", mode="w+", dtype=np.int32, shape=(nnz,))
+    indptr = np.lib.format.open_memmap(cache_dir / "matrix_indptr.npy", mode="w+", dtype=np.int64, shape=(shape[0] + 1,))
+    indptr[0] = 0
+    row = 0
+    written = 0
+    for block in matrix_blocks:
+        block = sp.csr_matrix(block)
+        block.sort_indices()
+        if block.shape[1] != shape[1] or row + block.shape[0] > shape[0] or written + block.nnz > nnz:
+            raise ValueError(f"Expression blocks do not add up to a {shape[0]} x {shape[1]} matrix with {nnz} values")
+        data[written : written + block.nnz] = block.data
+        indices[written : written + block.nnz] = block.indices
+        indptr[row + 1 : row + 1 + block.shape[0]] = block.indptr[1:] + written
+        row += block.shape[0]
+        written += block.nnz
+    if (row, written) != (shape[0], nnz):
+        raise ValueError(f"Expression blocks cover {row} of {shape[0]} genes and {written} of {nnz} values")
+    for array in (data, indices, indptr):
+        array.flush()
+    del data, indices, indptr
+
+
+def write_dataset_cache(
+    file_path: str | os.PathLike[str],
+    assay: str,
+    layer: str,
+    *,
+    metadata: pd.DataFrame,
+    umap: pd.DataFrame,
+    genes: list[str],
+    gene_symbols: list,
+    cells: list[str],
+    matrix_blocks: Iterable[sp.spmatrix],
+    nnz: int,
+) -> Path:
+    """
+    Persist a loaded dataset so the next load of the unchanged file can skip R.
+    matrix_blocks are consecutive blocks of gene rows (stacked, the genes x cells matrix
+    with nnz stored values); they are written one at a time, so the whole matrix is never
+    held in Python. The entry is written to a temporary directory and renamed into place,
+    so concurrent readers never see a half-written cache.
+    """
+    cache_dir = dataset_cache_dir(file_path, assay, layer)
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = cache_dir.with_name(f"{cache_dir.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    try:
+        _write_matrix(tmp_dir, matrix_blocks, (len(genes), len(cells)), nnz)
+        _write_frame(metadata, tmp_dir / "metadata.feather")
+        _write_frame(umap, tmp_dir / "umap.feather")
+        (tmp_dir / "names.json").write_text(
+            json.dumps(
+                {
+                    "genes": [str(g) for g in genes],
+                    "gene_symbols": [s if isinstance(s, str) else None for s in gene_symbols],
+                    "cells": [str(c) for c in cells],
+                }
+            )
+        )
+        (tmp_dir / "manifest.json").write_text(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "source": str(Path(file_path).resolve()),
+                    "assay": assay,
+                    "layer": layer,
+                    "shape": [len(genes), len(cells)],
+                    "nnz": int(nnz),
+                }
+            )
+        )
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if (cache_dir / "manifest.json").is_file():  # Somebody else won the race
+            return cache_dir
+        raise
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # Drop entries for earlier versions of the same file
+    for stale in cache_dir.parent.glob(f"{Path(file_path).stem}-*"):
+        if stale != cache_dir and stale.is_dir() and ".tmp-" not in stale.name:
+            manifest = stale / "manifest.json"
+            try:
+                stale_manifest = json.loads(manifest.read_text()) if manifest.is_file() else {}
+            except (OSError, ValueError):
+                stale_manifest = {}
+            stale_identity = (stale_manifest.get("source"), stale_manifest.get("assay"), stale_manifest.get("layer"))
+            if stale_identity == (str(Path(file_path).resolve()), assay, layer):
+                shutil.rmtree(stale, ignore_errors=True)
+
+    return cache_dir
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Ensembl ID -> symbol tables, one per annotation package version, shared by every dataset
+def symbol_table_path(org_package: str, version: str) -> Path:
+    return Path(settings.SYMBOL_CACHE_DIR) / f"ensembl-symbols-{org_package}-{version}.feather"
+
+
+def read_symbol_table(org_package: str, version: str) -> pd.DataFrame | None:
+    """Return the cached (ensembl, symbol) table for the package version, or None on a cache miss."""
+    path = symbol_table_path(org_package, version)
+    if not path.is_file():
+        return None
+    try:
+        return pd.read_feather(path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable symbol table {path}: {e}")
+        return None
+
+
+def write_symbol_table(org_package: str, version: str, table: pd.DataFrame) -> Path:
+    """Persist an (ensembl, symbol) table; written to a temporary file and renamed into place."""
+    path = symbol_table_path(org_package, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+    try:
+        table.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    # Drop tables of earlier versions of the same package
+    for stale in path.parent.glob(f"ensembl-symbols-{org_package}-*.feather"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+# -------------------------------------------------------------------
@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from threading import RLock
+from typing import Any
+
+from load_jobs import LoadCancelled
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_dataset_bytes(dataset: dict[str, Any]) -> int:
+    """Rough resident size of a loaded dataset: metadata, UMAP and whatever the matrix keeps in memory."""
+    nbytes = int(dataset.get("matrix_bytes", 0))
+    for name in ("metadata", "umap"):
+        frame = dataset.get(name)
+        if frame is not None:
+            nbytes += int(frame.memory_usage(deep=True).sum())
+    nbytes += 200 * len(dataset.get("genes", ())) + 100 * len(dataset.get("cells", ()))  # Name lists and gene maps
+    return nbytes
+
+
+class DatasetRegistry:
+    """
+    Process-wide registry of loaded datasets, shared between browser sessions.
+
+    Datasets are keyed by file identity (see dataset_cache.dataset_cache_key), so every
+    session that opens the same unchanged file gets the same dataset dict. Concurrent
+    acquire() calls for one identity run a single load; the others wait for it. Each
+    acquire() must be paired with a release(); datasets nobody holds stay resident until
+    the memory budget is exceeded, and are then evicted least recently used first.
+    """
+
+    def __init__(self, budget_bytes: int, evict: Callable[[dict[str, Any]], None]):
+        self._budget_bytes = budget_bytes
+        self._evict = evict
+        self._entries: OrderedDict[str, dict[str, Any]] = OrderedDict()  # LRU order, oldest first
+        self._inflight: dict[str, dict[str, Any]] = {}
+        self._lock = RLock()
+
+    def acquire(
+        self,
+        dataset_id: str,
+        load: Callable[[Callable[[str], None]], dict[str, Any]],
+        progress: Callable[[str], None] | None = None,
+    ) -> dict[str, Any]:
+        """Return the dataset for dataset_id, loading it (once) if needed, and take a reference to it."""
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is not None:
+                entry["refs"] += 1
+                entry["last_used"] = time.monotonic()
+                self._entries.move_to_end(dataset_id)
+                return entry["dataset"]
+            flight = self._inflight.get(dataset_id)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event(), "phase": "queued", "waiters": 0, "error": None}
+                self._inflight[dataset_id] = flight
+            else:
+                flight["waiters"] += 1
+
+        if leader:
+            return self._lead(dataset_id, flight, load, progress)
+        return self._wait(dataset_id, flight, load, progress)
+
+    def _lead(self, dataset_id, flight, load, progress):
+        detached = False
+
+        def leader_progress(phase: str) -> None:
+            nonlocal detached
+            flight["phase"] = phase
+            if progress is None or detached:
+                return
+            try:
+                progress(phase)
+            except LoadCancelled:
+                with self._lock:
+                    if not flight["waiters"]:
+                        raise
+                # Other sessions still want this dataset: finish the load for them. The caller
+                # gets a reference anyway and is expected to release it.
+                detached = True
+
+        try:
+            dataset = load(leader_progress)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[dataset_id]
+                flight["error"] = e
+                flight["done"].set()
+            raise
+
+        dataset["dataset_id"] = dataset_id
+        with self._lock:
+            del self._inflight[dataset_id]
+            self._entries[dataset_id] = {
+                "dataset": dataset,
+                "refs": 1 + flight["waiters"],
+                "nbytes": estimate_dataset_bytes(dataset),
+                "last_used": time.monotonic(),
+            }
+            flight["done"].set()
+            evicted = self._over_budget()
+        self._evict_all(evicted)
+        return dataset
+
+    def _wait(self, dataset_id, flight, load, progress):
+        try:
+            while not flight["done"].wait(0.25):
+                if progress is not None:
+                    progress(flight["phase"])  # Mirror the leader's phase; raises if this caller is cancelled
+        except BaseException:
+            with self._lock:
+                finished = flight["done"].is_set()
+                if not finished:
+                    flight["waiters"] -= 1
+            if finished and flight["error"] is None:
+                self.release(dataset_id)  # The load finished meanwhile and already counted this waiter
+            raise
+
+        if isinstance(flight["error"], LoadCancelled):
+            return self.acquire(dataset_id, load, progress)  # The leader gave up; try again ourselves
+        if flight["error"] is not None:
+            raise RuntimeError(str(flight["error"])) from flight["error"]
+        with self._lock:
+            return self._entries[dataset_id]["dataset"]
+
+    def release(self, dataset_id: str | None) -> None:
+        """Drop one reference; idle datasets may be evicted to stay within the memory budget."""
+        if not dataset_id:
+            return
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return
+            entry["refs"] = max(entry["refs"] - 1, 0)
+            entry["last_used"] = time.monotonic()
+            evicted = self._over_budget()
+        self._evict_all(evicted)
+
+    def expire_idle(self, ttl_seconds: float) -> int:
+        """Evict datasets nobody has held for ttl_seconds, regardless of the budget; return how many."""
+        cutoff = time.monotonic() - ttl_seconds
+        with self._lock:
+            evicted = []
+            for dataset_id, entry in list(self._entries.items()):
+                if entry["refs"] == 0 and entry["last_used"] < cutoff:
+                    del self._entries[dataset_id]
+                    logger.info(f"Evicting dataset {dataset_id}, idle for more than {ttl_seconds:.0f} s")
+                    evicted.append(entry["dataset"])
+        self._evict_all(evicted)
+        return len(evicted)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """Resident and loading datasets with their reference counts, estimated size and idle time."""
+        now = time.monotonic()
+        with self._lock:
+            resident = [
+                {
+                    "dataset_id": dataset_id,
+                    "handle": entry["dataset"].get("seurat_handle"),
+                    "refs": entry["refs"],
+                    "mb": round(entry["nbytes"] / 1_048_576, 1),
+                    "idle_seconds": round(now - entry["last_used"], 1) if entry["refs"] == 0 else 0.0,
+                    "cells": len(entry["dataset"].get("cells", ())),
+                    "genes": len(entry["dataset"].get("genes", ())),
+                }
+                for dataset_id, entry in self._entries.items()
+            ]
+            loading = [
+                {"dataset_id": dataset_id, "phase": flight["phase"], "waiters": flight["waiters"]}
+                for dataset_id, flight in self._inflight.items()
+            ]
+        return resident + loading
+
+    def _over_budget(self) -> list[dict[str, Any]]:
+        """Unregister idle datasets, least recently used first, until the budget is met. Call with the lock held."""
+        evicted = []
+        total = sum(entry["nbytes"] for entry in self._entries.values())
+        for dataset_id in list(self._entries):
+            if total <= self._budget_bytes:
+                break
+            entry = self._entries[dataset_id]
+            if entry["refs"] > 0:
+                continue
+            del self._entries[dataset_id]
+            total -= entry["nbytes"]
+            logger.info(f"Evicting idle dataset {dataset_id} ({entry['nbytes'] / 1_048_576:.0f} MB) to stay within the memory budget")
+            evicted.append(entry["dataset"])
+        return evicted
+
+    def _evict_all(self, datasets: list[dict[str, Any]]) -> None:
+        for dataset in datasets:
+            self._evict(dataset)
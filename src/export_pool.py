@@ -0,0 +1,98 @@
+import json
+import logging
+import multiprocessing as mp
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from threading import Lock
+from typing import Any
+
+import plotly.io as pio
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("svg", "png", "pdf")
+
+# Export styling: transparent background and no template, applied to a copy of the figure
+_EXPORT_LAYOUT = {"template": None, "paper_bgcolor": "rgba(0,0,0,0)", "plot_bgcolor": "rgba(0,0,0,0)"}
+
+
+def render_figure(figure_json: str, fmt: str) -> bytes:
+    """Render a figure (as JSON) to svg, png or pdf bytes with export styling."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    figure = json.loads(figure_json)
+    figure.setdefault("layout", {}).update(_EXPORT_LAYOUT)
+    return pio.to_image(figure, format=fmt, validate=False)  # Built by our own code; skip re-validating every trace
+
+
+def _warm_up() -> None:
+    """Pool initializer: import the renderer and, where kaleido supports it, keep its browser running."""
+    try:
+        import kaleido
+
+        if hasattr(kaleido, "start_sync_server"):
+            kaleido.start_sync_server(silence_warnings=True)
+    except Exception as e:  # Rendering still works, just with a cold start per figure
+        logger.warning(f"Could not warm up the export renderer: {e}")
+
+
+class ExportPool:
+    """
+    A persistent pool of renderer processes. Figures are rendered in parallel and handed
+    back in completion order, so callers can write each one out as soon as it is ready.
+    """
+
+    def __init__(self, size: int):
+        ctx = mp.get_context("spawn")  # Like the R workers: no fork of a threaded server process
+        self._executor = ProcessPoolExecutor(max_workers=size, mp_context=ctx, initializer=_warm_up)
+
+    def render_one(self, figure_json: str, fmt: str) -> bytes:
+        return self._executor.submit(render_figure, figure_json, fmt).result()
+
+    def render(self, jobs: Iterable[tuple[Any, str, str]]) -> Iterator[tuple[Any, bytes]]:
+        """Render (tag, figure_json, fmt) jobs; yield (tag, bytes) as each one completes."""
+        futures: dict[Future, Any] = {
+            self._executor.submit(render_figure, figure_json, fmt): tag for tag, figure_json, fmt in jobs
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def render(figure_json: str, fmt: str) -> bytes:
+    """Render one figure on the export pool, or in-process when it is disabled."""
+    pool = get_export_pool()
+    if pool is None:
+        return render_figure(figure_json, fmt)
+    return pool.render_one(figure_json, fmt)
+
+
+def render_all(jobs: Iterable[tuple[Any, str, str]]) -> Iterator[tuple[Any, bytes]]:
+    """Render (tag, figure_json, fmt) jobs on the export pool, or in-process when it is disabled."""
+    pool = get_export_pool()
+    if pool is not None:
+        yield from pool.render(jobs)
+        return
+    for tag, figure_json, fmt in jobs:
+        yield tag, render_figure(figure_json, fmt)
+
+
+_pool: ExportPool | None = None
+_pool_lock = Lock()
+
+
+def get_export_pool() -> ExportPool | None:
+    """Return the process-wide export pool, starting it on first use, or None when exports render in-process."""
+    global _pool
+    if settings.EXPORT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f"Starting {settings.EXPORT_WORKERS} export renderer processes")
+            _pool = ExportPool(settings.EXPORT_WORKERS)
+        return _pool
@@ -0,0 +1,101 @@
+import os
+import secrets
+import time
+from pathlib import Path
+from threading import RLock
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# -------------------------------------------------------------------
+class GeneRowStore:
+    """
+    Read-only genes x cells CSR matrix memory-mapped from a dataset cache directory.
+
+    Only the index pointer is touched when the store is opened; gene rows are
+    gathered straight from the mapped files, so the OS pages in just the rows
+    that are requested and shares those pages between processes.
+    """
+
+    def __init__(self, cache_dir: str | os.PathLike[str], genes: list[str], cells: list[str]):
+        cache_dir = Path(cache_dir)
+        self.cache_dir = cache_dir
+        self.indptr = np.load(cache_dir / "matrix_indptr.npy", mmap_mode="r")
+        self.indices = np.load(cache_dir / "matrix_indices.npy", mmap_mode="r")
+        self.data = np.load(cache_dir / "matrix_data.npy", mmap_mode="r")
+        self.genes = pd.Index(genes)
+        self.cells = pd.Index(cells)
+        if len(self.indptr) != len(self.genes) + 1:
+            raise ValueError(f"Expression store {cache_dir} does not match its gene list")
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (len(self.genes), len(self.cells))
+
+    def rows(self, gene_positions: np.ndarray, cell_positions: np.ndarray | None = None) -> sp.csr_matrix:
+        """Gather the given gene rows (optionally restricted to cell positions) into an in-memory CSR matrix."""
+        gene_positions = np.asarray(gene_positions, dtype=np.int64)
+        starts = np.asarray(self.indptr[gene_positions], dtype=np.int64)
+        lengths = np.asarray(self.indptr[gene_positions + 1], dtype=np.int64) - starts
+        indptr = np.zeros(len(gene_positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+
+        # Flat positions of every stored value in the requested rows, without a Python loop
+        take = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1], dtype=np.int64)
+        matrix = sp.csr_matrix(
+            (np.asarray(self.data[take]), np.asarray(self.indices[take]), indptr),
+            shape=(len(gene_positions), len(self.cells)),
+        )
+        if cell_positions is not None:
+            matrix = matrix[:, np.asarray(cell_positions, dtype=np.int64)]
+        return matrix
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Registry of open stores. Handles are per load; stores are shared per cache directory.
+_stores: dict[Path, GeneRowStore] = {}
+_store_handles: dict[str, Path] = {}
+_lock = RLock()
+
+
+def register_store(
+    file_path: str | os.PathLike[str],
+    cache_dir: str | os.PathLike[str],
+    genes: list[str],
+    cells: list[str],
+    handle: str | None = None,
+) -> str:
+    """Open (or reuse) the store for cache_dir and return a new handle for it (or register the given one)."""
+    cache_dir = Path(cache_dir)
+    handle = handle or f"{os.path.basename(file_path)}_mmap_{int(time.time())}_{secrets.randbelow(10**9)}"
+    with _lock:
+        if cache_dir not in _stores:
+            _stores[cache_dir] = GeneRowStore(cache_dir, genes, cells)
+        _store_handles[handle] = cache_dir
+    return handle
+
+
+def get_store(handle: str | None) -> GeneRowStore | None:
+    """Return the store behind handle, or None if the handle is owned by R."""
+    if not handle:
+        return None
+    with _lock:
+        cache_dir = _store_handles.get(handle)
+        return _stores.get(cache_dir) if cache_dir is not None else None
+
+
+def release_store(handle: str | None) -> bool:
+    """Forget handle; the store itself is closed once no handle refers to it."""
+    if not handle:
+        return False
+    with _lock:
+        cache_dir = _store_handles.pop(handle, None)
+        if cache_dir is None:
+            return False
+        if cache_dir not in _store_handles.values():
+            _stores.pop(cache_dir, None)
+    return True
+# -------------------------------------------------------------------
@@ -0,0 +1,73 @@
+from bisect import bisect_left
+
+import numpy as np
+
+
+class GeneSearchIndex:
+    """
+    Search over gene IDs and symbols, built once per dataset so the gene selector only
+    receives the matches for what the user has typed instead of every gene.
+
+    Keys are the case-folded symbols (from gene_ids_by_symbol_folded) and case-folded
+    gene IDs, kept sorted for prefix lookups by bisection and joined into one string for
+    substring lookups with str.find. Matches rank exact first, then prefix, then
+    substring; within a rank, alphabetically by key.
+    """
+
+    def __init__(self, genes: list[str], gene_labels: dict[str, str], gene_ids_by_symbol_folded: dict[str, list[str]]):
+        self.genes = genes
+        self.gene_labels = gene_labels
+        keyed: dict[str, list[str]] = {symbol: list(ids) for symbol, ids in gene_ids_by_symbol_folded.items()}
+        for gene in genes:
+            ids = keyed.setdefault(gene.casefold(), [])
+            if gene not in ids:
+                ids.append(gene)
+        self._keys = sorted(keyed)
+        self._gene_ids = [keyed[key] for key in self._keys]
+        self._haystack = "\n".join(self._keys)  # Keys never contain newlines
+        self._offsets = np.cumsum([0] + [len(key) + 1 for key in self._keys[:-1]])
+
+    def _prefix_range(self, query: str) -> tuple[int, int]:
+        start = bisect_left(self._keys, query)
+        stop = bisect_left(self._keys, query + "\U0010ffff", lo=start)
+        return start, stop
+
+    def _substring_positions(self, query: str, limit: int) -> list[int]:
+        positions = []
+        found = self._haystack.find(query)
+        while found != -1 and len(positions) < limit:
+            position = int(np.searchsorted(self._offsets, found, side="right")) - 1
+            positions.append(position)
+            found = self._haystack.find(query, int(self._offsets[position + 1]) if position + 1 < len(self._offsets) else len(self._haystack))
+        return positions
+
+    def search(self, query: str | None, limit: int) -> list[str]:
+        """Gene IDs best matching query (by symbol or ID, case-insensitive), at most limit of them."""
+        query = (query or "").strip().casefold()
+        if not query:
+            return self.genes[:limit]
+
+        matches: dict[str, None] = {}  # Ordered set
+
+        def add(positions) -> bool:
+            for position in positions:
+                for gene in self._gene_ids[position]:
+                    matches[gene] = None
+                if len(matches) >= limit:
+                    return True
+            return False
+
+        start, stop = self._prefix_range(query)
+        exact = [start] if start < stop and self._keys[start] == query else []
+        if add(exact) or add(range(start + len(exact), stop)):
+            return list(matches)[:limit]
+        add(position for position in self._substring_positions(query, limit + stop - start) if not start <= position < stop)
+        return list(matches)[:limit]
+
+    def options(self, gene_ids: list[str]) -> list[dict[str, str]]:
+        """Dropdown options for gene_ids; the search text lets the browser match IDs behind symbol labels."""
+        options = []
+        for gene in gene_ids:
+            label = self.gene_labels.get(gene, gene)
+            options.append({"label": label, "value": gene, "search": f"{label} {gene}"})
+        return options
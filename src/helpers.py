@@ -1,60 +1,251 @@
 import base64
+import hashlib
 import json
 import os
+from collections import OrderedDict
+from collections.abc import Callable
 from pathlib import Path
+from threading import RLock
+from typing import Any, NamedTuple
 
 import dash_bootstrap_components as dbc
 import numpy as np
 import pandas as pd
 import plotly.express as px
-import rpy2.robjects as ro
+import plotly.graph_objects as go
+import scipy.sparse as sp
 import yaml
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.conversion import localconverter
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.ndimage import gaussian_filter1d
 
 import settings
+from data_loader import r_expression_subset
+from expression_store import GeneRowStore, get_store
+from r_workers import get_r_pool
 
 
 # -------------------------------------------------------------------
-# Underlying function to fetch expression subset for given genes and cells
+# Sparse genes x cells expression block, as returned by fetch_expression_subset
+class ExpressionSubset(NamedTuple):
+    matrix: sp.csr_matrix  # genes x cells, CSR so that per-gene rows are cheap to slice
+    genes: list[str]
+    cells: list[str]
+
+    def dense_rows(self, genes: list[str] | None = None) -> np.ndarray:
+        """Densify the rows for the given genes (all genes if None) into a genes x cells array."""
+        if genes is None:
+            rows = self.matrix
+        else:
+            positions = {gene: idx for idx, gene in enumerate(self.genes)}
+            rows = self.matrix[[positions[gene] for gene in genes if gene in positions]]
+        _check_dense_size(rows.shape[0], rows.shape[1])
+        return rows.toarray()
+
+    def to_frame(self, genes: list[str] | None = None) -> pd.DataFrame:
+        """Densify the rows for the given genes into a genes x cells DataFrame."""
+        if genes is None:
+            rownames = self.genes
+        else:
+            available = set(self.genes)
+            rownames = [gene for gene in genes if gene in available]
+        return pd.DataFrame(self.dense_rows(rownames), index=rownames, columns=self.cells)
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Refuse to densify blocks that would not fit comfortably in memory
+def _check_dense_size(n_rows: int, n_cols: int) -> None:
+    bytes_needed = float(n_rows) * float(n_cols) * 8
+    if bytes_needed > settings.max_dense_mb * 1024**2:
+        raise ValueError(
+            f"Expression subset too large to materialize safely ({n_rows} x {n_cols}, ~{bytes_needed / 1024**2:.1f} MB dense). "
+            "Refine filters or reduce genes/cells."
+        )
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Positions of the requested labels in index, keeping request order and dropping unknowns (like R's intersect)
+def _label_positions(index: pd.Index, labels: list[str]) -> np.ndarray:
+    positions = index.get_indexer(list(dict.fromkeys(labels)))
+    return positions[positions >= 0]
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Subset a dataset served from its memory-mapped gene-row store without going through R
+def _store_expression_subset(store: GeneRowStore, genes: list[str] | None, cells: np.ndarray | None):
+    gene_positions = _label_positions(store.genes, genes) if genes else np.arange(len(store.genes))
+    matrix = store.rows(gene_positions, cells)
+    colnames = store.cells[cells] if cells is not None else store.cells
+
+    return (matrix, list(store.genes[gene_positions]), list(colnames))
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# LRU cache of full-length per-gene expression rows, so cell subsetting happens in NumPy
+class GeneVectorCache:
+    """
+    Keep whole sparse gene rows (all cells of a handle) up to a byte budget,
+    evicting the least recently used rows first. Rows are stored as
+    (column indices, values) pairs; the handle's cell names are kept once.
+    Genes the backend does not know are remembered per handle, so requests
+    including them are not sent back to the backend every time.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._rows: OrderedDict[tuple[str, str], tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._cells: dict[str, pd.Index] = {}
+        self._unknown: dict[str, set[str]] = {}
+        self._nbytes = 0
+        self._lock = RLock()
+
+    def cells(self, handle: str) -> pd.Index | None:
+        with self._lock:
+            return self._cells.get(handle)
+
+    def known(self, handle: str, genes: list[str]) -> list[str]:
+        """genes without those the backend reported as unknown for handle."""
+        with self._lock:
+            unknown = self._unknown.get(handle)
+            return [gene for gene in genes if gene not in unknown] if unknown else genes
+
+    def put_unknown(self, handle: str, genes: list[str]) -> None:
+        with self._lock:
+            self._unknown.setdefault(handle, set()).update(genes)
+
+    def get_many(self, handle: str, genes: list[str]) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        found = {}
+        with self._lock:
+            for gene in genes:
+                row = self._rows.get((handle, gene))
+                if row is not None:
+                    self._rows.move_to_end((handle, gene))
+                    found[gene] = row
+        return found
+
+    def put_many(self, handle: str, rows: dict[str, tuple[np.ndarray, np.ndarray]], cells: pd.Index) -> None:
+        with self._lock:
+            self._cells.setdefault(handle, cells)
+            for gene, row in rows.items():
+                key = (handle, gene)
+                if key in self._rows:
+                    continue
+                self._rows[key] = row
+                self._nbytes += row[0].nbytes + row[1].nbytes
+            while self._nbytes > self._max_bytes and self._rows:
+                _, (indices, values) = self._rows.popitem(last=False)
+                self._nbytes -= indices.nbytes + values.nbytes
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return {"mb": round(self._nbytes / 1_048_576, 1), "rows": len(self._rows), "handles": len(self._cells)}
+
+    def drop_handle(self, handle: str | None) -> None:
+        with self._lock:
+            self._cells.pop(handle, None)
+            self._unknown.pop(handle, None)
+            for key in [key for key in self._rows if key[0] == handle]:
+                indices, values = self._rows.pop(key)
+                self._nbytes -= indices.nbytes + values.nbytes
+
+
+expression_cache = GeneVectorCache(settings.EXPRESSION_CACHE_MB * 1_048_576)
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Underlying function to fetch expression subset for given genes and cells, through the gene vector cache
 def _expression_subset(
     seurat_handle: str,
     genes: list[str] | None = None,
-    cells: list[str] | None = None,
+    cells: np.ndarray | None = None,
 ):
-    with localconverter(ro.default_converter + pandas2ri.converter):
-        r_genes = ro.StrVector(genes) if genes else ro.NULL
-        r_cells = ro.StrVector(cells) if cells else ro.NULL
-        res = ro.r["get_expression_subset_matrix"](seurat_handle, r_genes, r_cells)  # type: ignore
+    if not genes:  # Whole-matrix requests would only flush the cache
+        return _backend_expression_subset(seurat_handle, genes, cells)
+
+    requested = list(dict.fromkeys(genes))
+    genes = expression_cache.known(seurat_handle, requested)
+    rows = expression_cache.get_many(seurat_handle, genes)
+    all_cells = expression_cache.cells(seurat_handle)
+    missing = [gene for gene in genes if gene not in rows]
+    if missing or all_cells is None:
+        # Fetch full-length rows (every cell) so later filter changes can be served from the cache
+        (matrix, rownames, colnames) = _backend_expression_subset(seurat_handle, missing or (genes or requested)[:1], None)
+        all_cells = pd.Index(colnames)
+        fetched = {}
+        for i, gene in enumerate(rownames):
+            start, end = matrix.indptr[i], matrix.indptr[i + 1]
+            fetched[gene] = (matrix.indices[start:end].copy(), matrix.data[start:end].copy())
+        expression_cache.put_many(seurat_handle, fetched, all_cells)
+        expression_cache.put_unknown(seurat_handle, [gene for gene in missing if gene not in fetched])
+        rows.update(fetched)
+
+    rownames = [gene for gene in genes if gene in rows]  # Unknown genes are dropped, like R's intersect
+    lengths = np.array([len(rows[gene][0]) for gene in rownames], dtype=np.int64)
+    indptr = np.zeros(len(rownames) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    matrix = sp.csr_matrix(
+        (
+            np.concatenate([rows[gene][1] for gene in rownames]) if rownames else np.zeros(0),
+            np.concatenate([rows[gene][0] for gene in rownames]) if rownames else np.zeros(0, dtype=np.int32),
+            indptr,
+        ),
+        shape=(len(rownames), len(all_cells)),
+    )
+    if cells is None:
+        return (matrix, rownames, list(all_cells))
+
+    return (matrix[:, cells], rownames, list(all_cells[cells]))
+# -------------------------------------------------------------------
 
-    values = res[0]
-    rownames = list(res[1])
-    colnames = list(res[2])
 
-    return (values, rownames, colnames)
+# -------------------------------------------------------------------
+# Fetch an expression subset from the dataset's backend (memory-mapped store or R)
+def _backend_expression_subset(
+    seurat_handle: str,
+    genes: list[str] | None = None,
+    cells: np.ndarray | None = None,
+):
+    pool = get_r_pool()
+    if pool is not None:
+        pool.restore(seurat_handle)  # Reloads the dataset if the R worker holding it died
+    store = get_store(seurat_handle)
+    if store is not None:
+        return _store_expression_subset(store, genes, cells)
+    if pool is not None and pool.owns(seurat_handle):
+        return pool.subset(seurat_handle, genes, cells)
+
+    return r_expression_subset(seurat_handle, genes, cells)
 # -------------------------------------------------------------------
 
 # -------------------------------------------------------------------
-# Helper to fetch expression subset for given genes and cells
+# Helper to fetch expression subset for given genes and cells (cells are 0-based column positions)
 def fetch_expression_subset(
     seurat_handle: str,
     genes: list[str] | None = None,
-    cells: list[str] | None = None,
-) -> pd.DataFrame:
-    (values, rownames, colnames) = _expression_subset(seurat_handle, genes, cells)
+    cells: np.ndarray | None = None,
+) -> ExpressionSubset:
+    (matrix, rownames, colnames) = _expression_subset(seurat_handle, genes, cells)
 
-    return pd.DataFrame(values, index=rownames, columns=colnames)
+    return ExpressionSubset(matrix, rownames, colnames)
 # -------------------------------------------------------------------
 
 
 # -------------------------------------------------------------------
-# Helper to fetch expression subset for given genes and cells, returning z-scores
+# Helper to fetch expression subset for given genes and cells (positions), returning z-scores
 def fetch_expression_subset_zscores(
     seurat_handle: str,
     genes: list[str] | None = None,
-    cells: list[str] | None = None,
+    cells: np.ndarray | None = None,
 ) -> pd.DataFrame:
-    (values, rownames, colnames) = _expression_subset(seurat_handle, genes, cells)
+    (matrix, rownames, colnames) = _expression_subset(seurat_handle, genes, cells)
+
+    # Z-scores are dense by nature, so densify here (heatmap inputs are already capped)
+    _check_dense_size(matrix.shape[0], matrix.shape[1])
+    values = matrix.toarray()
 
     # Calculat z-scores across cells for each gene using numpy for efficiency
     means = values.mean(axis=1, keepdims=True)
@@ -66,6 +257,43 @@ def fetch_expression_subset_zscores(
 # -------------------------------------------------------------------
 
 
+# -------------------------------------------------------------------
+# Group means (pseudobulk) over every selected cell, z-scored across groups
+def fetch_expression_group_means_zscores(
+    seurat_handle: str,
+    genes: list[str] | None,
+    cells: np.ndarray,
+    groups: pd.Series,
+) -> pd.DataFrame:
+    """
+    Mean expression per gene and group of the cells at positions cells (groups aligns with
+    cells), computed as one sparse product with a cells x groups indicator matrix of 1/size
+    weights. Only the genes x groups result is ever dense.
+    """
+    categories = pd.Categorical(groups.to_numpy())
+    valid = np.flatnonzero(categories.codes >= 0)
+    if len(valid) == 0:
+        raise ValueError(f"No selected cells have a value in {groups.name}")
+    present = np.flatnonzero(np.bincount(categories.codes[valid], minlength=len(categories.categories)))
+    (matrix, rownames, _colnames) = _expression_subset(seurat_handle, genes, cells)
+
+    codes = np.searchsorted(present, categories.codes[valid])  # Renumber to the groups that occur
+    sizes = np.bincount(codes, minlength=len(present))
+    indicator = sp.csr_matrix(
+        (1.0 / sizes[codes], (valid, codes)),
+        shape=(matrix.shape[1], len(present)),
+    )
+    values = np.asarray((matrix @ indicator).todense())
+
+    means = values.mean(axis=1, keepdims=True)
+    stds = values.std(axis=1, keepdims=True)
+    stds[stds == 0] = 1.0
+    values = (values - means) / stds
+
+    return pd.DataFrame(values, index=rownames, columns=[str(c) for c in categories.categories[present]])
+# -------------------------------------------------------------------
+
+
 # -------------------------------------------------------------------
 # Helper to build the filter schema from the metadata
 def filter_from_metadata(metadata_df):
@@ -98,15 +326,15 @@ def filter_from_metadata(metadata_df):
 
 # -------------------------------------------------------------------
 # Helper to generate a boxplot figure
-def generate_boxplot(expression_df, cell_metadata, gene, shape_column, gene_label=None):
-    """Generate a boxplot figure lazily from expression data and metadata."""
+def generate_boxplot(expression, cell_metadata, gene, shape_column, gene_label=None):
+    """Generate a boxplot figure lazily from expression data and metadata (rows aligned with the expression columns)."""
     display_gene = gene_label or gene
-    plot_df = expression_df.transpose().copy()
-    plot_df.index.name = "Cell"
-    plot_df = plot_df.reset_index()
+    if gene not in expression.genes:
+        raise ValueError(f"Feature {gene} is not in the current data!")
+    plot_df = pd.DataFrame({"Cell": expression.cells, gene: expression.dense_rows([gene])[0]})
 
     if shape_column and shape_column in cell_metadata.columns:
-        plot_df = plot_df.merge(cell_metadata[[shape_column]], left_on="Cell", right_index=True, how="left")
+        plot_df[shape_column] = cell_metadata[shape_column].to_numpy()
 
     if shape_column and shape_column in plot_df.columns:
         fig_df = plot_df[["Cell", shape_column, gene]].rename(columns={gene: display_gene})
@@ -129,20 +357,236 @@ def generate_boxplot(expression_df, cell_metadata, gene, shape_column, gene_labe
 # -------------------------------------------------------------------
 
 
+# -------------------------------------------------------------------
+# Group-wise box statistics from category codes, without a Python loop over groups
+def _grouped_box_stats(values: np.ndarray, codes: np.ndarray, n_groups: int) -> dict[str, np.ndarray]:
+    """Quartiles (linear interpolation, as np.quantile), Tukey whiskers and outlier counts per group code."""
+    valid = codes >= 0
+    values, codes = values[valid], codes[valid]
+    order = np.lexsort((values, codes))  # Sorted by group, then by value
+    ordered = values[order]
+    sizes = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    last = np.maximum(sizes - 1, 0)
+
+    def quantile(q: float) -> np.ndarray:
+        position = last * q
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, last)
+        frac = position - below
+        lower = ordered[np.minimum(starts + below, len(ordered) - 1)] if len(ordered) else np.zeros(n_groups)
+        upper = ordered[np.minimum(starts + above, len(ordered) - 1)] if len(ordered) else np.zeros(n_groups)
+        return lower + (upper - lower) * frac
+
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    iqr = q3 - q1
+    low_fence, high_fence = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    n_low = np.bincount(codes, weights=values < low_fence[codes], minlength=n_groups).astype(np.int64)
+    n_high = np.bincount(codes, weights=values > high_fence[codes], minlength=n_groups).astype(np.int64)
+    if len(ordered):
+        lower_whisker = ordered[np.minimum(starts + n_low, len(ordered) - 1)]
+        upper_whisker = ordered[np.clip(starts + last - n_high, 0, len(ordered) - 1)]
+    else:
+        lower_whisker = upper_whisker = np.zeros(n_groups)
+    means = np.bincount(codes, weights=values, minlength=n_groups) / np.maximum(sizes, 1)
+    return {
+        "n": sizes,
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "mean": means,
+        "lowerfence": lower_whisker,
+        "upperfence": upper_whisker,
+        "outliers": n_low + n_high,
+    }
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Helper to generate a boxplot figure from precomputed statistics
+def generate_boxplot_summary(expression, cell_metadata, gene, shape_column, gene_label=None):
+    """Generate a boxplot that ships only per-group statistics (rows of cell_metadata align with the expression columns)."""
+    display_gene = gene_label or gene
+    if gene not in expression.genes:
+        raise ValueError(f"Feature {gene} is not in the current data!")
+    values = expression.dense_rows([gene])[0]
+
+    if shape_column and shape_column in cell_metadata.columns:
+        groups = pd.Categorical(cell_metadata[shape_column].to_numpy())
+        names, codes = [str(c) for c in groups.categories], groups.codes
+    else:
+        names, codes = [display_gene], np.zeros(len(values), dtype=np.int8)
+    stats = _grouped_box_stats(values, codes, len(names))
+    present = stats["n"] > 0
+
+    fig = go.Figure(
+        go.Box(
+            x=np.asarray(names)[present],
+            q1=stats["q1"][present],
+            median=stats["median"][present],
+            q3=stats["q3"][present],
+            mean=stats["mean"][present],
+            lowerfence=stats["lowerfence"][present],
+            upperfence=stats["upperfence"][present],
+            text=[f"n = {n:,}, outliers = {o:,}" for n, o in zip(stats["n"][present], stats["outliers"][present], strict=True)],
+            hoverinfo="x+y+text",
+            name=display_gene,
+            showlegend=False,
+        )
+    )
+    fig.update_layout(
+        title=f"Boxplot for {display_gene}",
+        xaxis_title=shape_column if shape_column and shape_column in cell_metadata.columns else None,
+        yaxis_title="Expression",
+    )
+    return fig
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Small LRU memo for derived results whose keys start with the dataset handle
+def approx_nbytes(value: Any) -> int:
+    """
+    Rough in-memory size of nested containers, arrays, plotly figures and Dash components,
+    counting shared objects once. Good enough to budget caches, far cheaper than serializing.
+    """
+    seen: set[int] = set()
+    total = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            total += item.nbytes + (56 * item.size if item.dtype == object else 0)  # Object arrays hold Python strings
+        elif isinstance(item, (str, bytes)):
+            total += 49 + len(item)
+        elif isinstance(item, dict):
+            total += 64 + 16 * len(item)
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            total += 56 + 8 * len(item)
+            stack.extend(item)
+        elif isinstance(item, go.Figure):
+            stack.extend((item._data, item._layout))  # The figure's own dicts; to_dict() would deep-copy them
+        elif hasattr(item, "to_plotly_json"):  # Dash components
+            stack.append(item.to_plotly_json())
+        else:
+            total += 16
+    return total
+
+
+class HandleKeyedCache:
+    """
+    Keep up to max_entries results keyed by tuples whose first element is the dataset
+    handle, evicting the least recently used first; drop_handle forgets a whole dataset.
+    With max_bytes, entries are also evicted while their total approx_nbytes exceeds it,
+    and a single result larger than that is not cached at all.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int | None = None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._sizes: dict[tuple, int] = {}
+        self._nbytes = 0
+        self._lock = RLock()
+
+    def get(self, key: tuple) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _pop(self, key: tuple) -> None:
+        del self._entries[key]
+        self._nbytes -= self._sizes.pop(key, 0)
+
+    def put(self, key: tuple, value: Any) -> None:
+        nbytes = approx_nbytes(value) if self._max_bytes is not None else 0  # Outside the lock
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if self._max_bytes is not None and nbytes > self._max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = nbytes
+            self._nbytes += nbytes
+            while len(self._entries) > self._max_entries or (self._max_bytes is not None and self._nbytes > self._max_bytes):
+                self._pop(next(iter(self._entries)))
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()  # Outside the lock; a concurrent duplicate computation is harmless
+            self.put(key, value)
+        return value
+
+    def drop_handle(self, handle: str | None) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == handle]:
+                self._pop(key)
+
+
+# Leaf orders of clustered heatmaps by (handle, axis, genes, cells digest, grouping), so re-rendering
+# the same heatmap (e.g. with other display settings) skips the clustering
+leaf_order_cache = HandleKeyedCache(settings.heatmap_cluster_cache_entries)
+# Built plots by (handle, plot type, genes, selection digest, shape column, heatmap options)
+figure_cache = HandleKeyedCache(settings.figure_cache_entries, settings.FIGURE_CACHE_MB * 1_048_576)
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Hierarchical clustering of heatmap rows/columns, memoized per dataset, gene set and cells
+def _leaf_order(values: np.ndarray) -> np.ndarray:
+    """Leaf order of an average-linkage tree (Euclidean on z-scores) with optimal leaf ordering."""
+    if len(values) < 3:
+        return np.arange(len(values))
+    tree = linkage(values, method="average", metric="euclidean", optimal_ordering=True)
+    return leaves_list(tree)
+
+
+def cluster_heatmap(
+    seurat_handle: str,
+    heatmap_df: pd.DataFrame,
+    cells: np.ndarray,
+    rows: bool = True,
+    columns: bool = True,
+    group_by: str | None = None,
+) -> pd.DataFrame:
+    """
+    Reorder the z-scored heatmap frame by clustering its rows (genes) and/or columns
+    (the cells at positions cells, or their groups when the frame is aggregated by group_by).
+    """
+    genes_key = tuple(heatmap_df.index)
+    cells_key = hashlib.sha1(np.ascontiguousarray(cells, dtype=np.int64).tobytes()).hexdigest()
+    values = heatmap_df.to_numpy()
+    if rows:
+        order = leaf_order_cache.get_or_compute((seurat_handle, "rows", genes_key, cells_key, group_by), lambda: _leaf_order(values))
+        heatmap_df = heatmap_df.iloc[order]
+    if columns:
+        order = leaf_order_cache.get_or_compute((seurat_handle, "columns", genes_key, cells_key, group_by), lambda: _leaf_order(values.T))
+        heatmap_df = heatmap_df.iloc[:, order]
+    return heatmap_df
+# -------------------------------------------------------------------
+
+
 # -------------------------------------------------------------------
 # Helper to generate a heatmap figure
-def generate_heatmap(heatmap_df, gene_labels=None):
+def generate_heatmap(heatmap_df, gene_labels=None, title="Gene Expression Heatmap", x_label="Barcodes"):
     display_df = heatmap_df.rename(index=lambda gene: gene_labels.get(gene, gene) if gene_labels else gene)
 
     heatmap_figure = px.imshow(
-        display_df,
+        display_df.to_numpy(dtype=np.float32),  # Plotly sends z as a base64 typed array; float32 halves it
         color_continuous_scale="Viridis",
-        title="Gene Expression Heatmap",
+        title=title,
         x=display_df.columns,  # columns
         y=display_df.index.tolist(), # rows
         aspect="auto",
         # aspect="equal",
-        labels=dict(x="Barcodes", y="Genes", color="Expr"),  # axis titles & color-bar
+        labels=dict(x=x_label, y="Genes", color="Expr"),  # axis titles & color-bar
     )
 
     # Don't show labels if there's too many
@@ -169,9 +613,162 @@ def generate_umap(umap_df, color, shape):
 # -------------------------------------------------------------------
 
 
+# -------------------------------------------------------------------
+# Density-preserving decimation of 2D points
+def decimate_points(x: np.ndarray, y: np.ndarray, max_points: int, bins: int = settings.umap_decimation_bins, seed: int = settings.umap_sampling_seed) -> np.ndarray:
+    """
+    Return sorted positions of at most max_points points. Each grid bin keeps its
+    share of points in proportion to its count, with at least one point, so the
+    relative density survives and sparse regions and outliers are not dropped.
+    The grid is coarsened until there are no more occupied bins than max_points.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points <= 0:
+        return np.arange(0)
+
+    def scale(v: np.ndarray) -> np.ndarray:
+        lo, hi = np.nanmin(v), np.nanmax(v)
+        return (np.nan_to_num(v, nan=lo) - lo) / (hi - lo) if hi > lo else np.zeros(n)
+
+    x_scaled = scale(np.asarray(x, dtype=np.float64))
+    y_scaled = scale(np.asarray(y, dtype=np.float64))
+    while True:
+        x_bins = np.minimum((x_scaled * bins).astype(np.int64), bins - 1)
+        y_bins = np.minimum((y_scaled * bins).astype(np.int64), bins - 1)
+        bin_ids = x_bins * bins + y_bins
+        counts = np.bincount(bin_ids, minlength=bins * bins)
+        occupied = np.count_nonzero(counts)
+        if occupied <= max_points or bins == 1:
+            break
+        bins = max(bins // 2, 1)  # One point per occupied bin would already exceed the budget
+
+    # occupied <= max_points < n here, so some points are left over for the proportional share
+    ratio = (max_points - occupied) / (n - occupied)
+    quota = 1 + np.floor((counts - 1) * ratio).astype(np.int64)
+
+    # Rank the points within their bin in random order and keep the first quota of each
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(n), bin_ids))
+    sorted_bins = bin_ids[order]
+    starts = np.searchsorted(sorted_bins, sorted_bins, side="left")
+    rank = np.arange(n) - starts
+    return np.sort(order[rank < quota[sorted_bins]])
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Helper to generate a WebGL UMAP scatterplot for large selections
+def generate_umap_gl(umap_df, color, shape, max_points: int = settings.max_umap_points):
+    """Generate a UMAP scatterplot rendered through WebGL, decimating the points above max_points."""
+    n_cells = len(umap_df)
+    keep = decimate_points(umap_df["UMAP_1"].to_numpy(), umap_df["UMAP_2"].to_numpy(), max_points)
+    title = "UMAP Scatterplot"
+    if len(keep) < n_cells:
+        umap_df = umap_df.iloc[keep]
+        color = color.iloc[keep] if color is not None else None
+        shape = shape.iloc[keep] if shape is not None else None
+        title += f" (showing {len(keep):,} of {n_cells:,} cells, density-preserving sample)"
+    umap_figure = px.scatter(
+        umap_df,
+        x="UMAP_1",
+        y="UMAP_2",
+        color=color,
+        symbol=shape,
+        title=title,
+        render_mode="webgl",
+    )
+    umap_figure.update_traces(marker={"size": 3})
+    return umap_figure
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Helper to generate a binned (density) UMAP for whole-atlas overviews
+def generate_umap_density(umap_df, color, bins: int = settings.umap_density_bins):
+    """
+    Aggregate the UMAP on a bins x bins grid and draw it as one heatmap trace, so the
+    figure size depends only on the grid. Without color, bins show the log cell count;
+    with a categorical color, the most frequent category; with a numeric color, the mean.
+    """
+    x = umap_df["UMAP_1"].to_numpy(dtype=np.float64)
+    y = umap_df["UMAP_2"].to_numpy(dtype=np.float64)
+    placed = np.isfinite(x) & np.isfinite(y)  # Cells without coordinates are left out, not binned at an edge
+    if not placed.all():
+        x, y = x[placed], y[placed]
+        color = color.iloc[placed] if color is not None else None
+    if len(x) == 0:
+        raise ValueError("No selected cells have UMAP coordinates.")
+    x_edges = np.linspace(x.min(), x.max(), bins + 1)
+    y_edges = np.linspace(y.min(), y.max(), bins + 1)
+    x_bin = np.clip(np.searchsorted(x_edges, x, side="right") - 1, 0, bins - 1)
+    y_bin = np.clip(np.searchsorted(y_edges, y, side="right") - 1, 0, bins - 1)
+    flat = y_bin * bins + x_bin  # Row-major over (y, x), the heatmap's z layout
+    counts = np.bincount(flat, minlength=bins * bins)
+    empty = counts == 0
+
+    hover = "UMAP_1: %{x:.2f}<br>UMAP_2: %{y:.2f}<br>Cells: %{customdata}"
+    trace_args = {}
+    if color is None:
+        z = np.log10(counts.astype(np.float32) + 1)
+        trace_args.update(colorscale="Viridis", colorbar={"title": "log10 cells"})
+        title = "UMAP Density"
+    elif isinstance(color.dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(color):
+        values = pd.Categorical(color)
+        categories = values.categories
+        valid = values.codes >= 0
+        per_category = np.bincount(
+            flat[valid] * len(categories) + values.codes[valid],
+            minlength=bins * bins * len(categories),
+        ).reshape(bins * bins, len(categories))
+        z = per_category.argmax(axis=1).astype(np.float32)
+        z[per_category.sum(axis=1) == 0] = np.nan
+        palette = px.colors.qualitative.Plotly
+        n = max(len(categories), 1)
+        colorscale = []
+        for i in range(n):  # Stepped scale: one flat color band per category code
+            colorscale += [[i / n, palette[i % len(palette)]], [(i + 1) / n, palette[i % len(palette)]]]
+        trace_args.update(
+            colorscale=colorscale,
+            zmin=-0.5,
+            zmax=n - 0.5,
+            colorbar={"title": color.name, "tickvals": list(range(n)), "ticktext": [str(c) for c in categories]},
+            text=np.where(empty, "", np.asarray(categories.astype(str))[np.nan_to_num(z, nan=0).astype(np.int64)]).reshape(bins, bins),
+        )
+        hover += f"<br>Most frequent {color.name}: %{{text}}"
+        title = f"UMAP Density (most frequent {color.name} per bin)"
+    else:
+        values = color.to_numpy(dtype=np.float64)
+        known = ~np.isnan(values)  # Cells without a value count towards neither sum nor denominator
+        sums = np.bincount(flat[known], weights=values[known], minlength=bins * bins)
+        valued = np.bincount(flat[known], minlength=bins * bins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (sums / valued).astype(np.float32)
+        trace_args.update(colorscale="Viridis", colorbar={"title": f"mean {color.name}"})
+        hover += f"<br>Mean {color.name}: %{{z:.3g}}"
+        title = f"UMAP Density (mean {color.name} per bin)"
+
+    z = np.where(empty, np.nan, z).reshape(bins, bins)
+    umap_figure = go.Figure(
+        go.Heatmap(
+            z=z,
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            customdata=counts.reshape(bins, bins),
+            hovertemplate=hover + "<extra></extra>",
+            hoverongaps=False,
+            **trace_args,
+        )
+    )
+    umap_figure.update_layout(title=f"{title} - {len(x):,} cells", xaxis_title="UMAP_1", yaxis_title="UMAP_2")
+    return umap_figure
+# -------------------------------------------------------------------
+
+
 # -------------------------------------------------------------------
 # Helper to generate a violin plot figure
-def generate_violin(violin_df, genes, cell_metadata, shape_column, gene_labels=None):
+def generate_violin(expression, genes, cell_metadata, shape_column, gene_labels=None):
     """Generate a violin plot figure."""
 
     if not genes:
@@ -179,14 +776,14 @@ def generate_violin(violin_df, genes, cell_metadata, shape_column, gene_labels=N
     elif len(genes) > settings.max_features:
         raise ValueError(f"For Violin plots please select no more than {settings.max_features} features.")
 
-    plot_df = violin_df.transpose().copy()
+    plot_df = expression.to_frame(genes).transpose()
     plot_df.index.name = "Cell"
     plot_df = plot_df.reset_index()
     if gene_labels:
         plot_df = plot_df.rename(columns={gene: gene_labels.get(gene, gene) for gene in genes})
 
     if shape_column and shape_column in cell_metadata.columns:
-        plot_df = plot_df.merge(cell_metadata[[shape_column]], left_on="Cell", right_index=True, how="left")
+        plot_df[shape_column] = cell_metadata[shape_column].to_numpy()  # Rows align with the expression columns
 
     id_vars = ["Cell"]
     if shape_column and shape_column in plot_df.columns:
@@ -208,6 +805,133 @@ def generate_violin(violin_df, genes, cell_metadata, shape_column, gene_labels=N
 # -------------------------------------------------------------------
 
 
+# -------------------------------------------------------------------
+# Precomputed violin summaries: binned Gaussian KDE plus quartiles, computed on the server
+def _violin_summary(values: np.ndarray, n_points: int) -> dict:
+    """KDE curve on an n_points grid spanning the values, quartiles and Tukey fences of one group."""
+    lo, hi = float(values.min()), float(values.max())
+    if hi <= lo:  # Constant group: no spread to estimate, drawn as a single line at the value
+        return {"grid": np.array([lo, lo]), "density": np.ones(2), "q1": lo, "median": lo, "q3": lo, "fences": (lo, lo), "n": len(values)}
+    span = hi - lo
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+
+    # Histogram on the grid, then smooth with a Gaussian whose width follows Silverman's rule
+    bins = np.clip(np.rint((values - lo) / span * (n_points - 1)).astype(np.int64), 0, n_points - 1)
+    density = np.bincount(bins, minlength=n_points).astype(np.float64)
+    sd = float(values.std())
+    spread = min(sd, iqr / 1.34) if iqr > 0 else sd
+    bandwidth = 0.9 * spread * len(values) ** -0.2
+    if bandwidth > 0:
+        density = gaussian_filter1d(density, bandwidth / span * (n_points - 1), mode="constant")
+
+    return {
+        "grid": lo + np.linspace(0.0, 1.0, n_points) * span,
+        "density": density / density.max() if density.max() > 0 else density,
+        "q1": q1,
+        "median": median,
+        "q3": q3,
+        "fences": (q1 - 1.5 * iqr, q3 + 1.5 * iqr),
+        "n": len(values),
+    }
+
+
+def generate_violin_summary(expression, genes, cell_metadata, shape_column, gene_labels=None, n_points: int = settings.violin_kde_points, max_outliers: int = settings.violin_max_outliers):
+    """
+    Generate a violin plot from server-side summaries: each violin is a filled outline of
+    its KDE with the interquartile range and median drawn on top, plus a seeded sample of
+    at most max_outliers points beyond the fences. The figure size depends on the number
+    of violins, not on the number of cells.
+    """
+    if not genes:
+        raise ValueError("For Violin plots please select one or more features.")
+    elif len(genes) > settings.max_features:
+        raise ValueError(f"For Violin plots please select no more than {settings.max_features} features.")
+
+    available = set(expression.genes)
+    genes = [gene for gene in genes if gene in available]  # dense_rows skips missing genes; keep rows and genes aligned
+    if not genes:
+        raise ValueError("None of the selected features have expression values in this dataset.")
+    if shape_column and shape_column in cell_metadata.columns:
+        groups = pd.Categorical(cell_metadata[shape_column].to_numpy())  # Rows align with the expression columns
+        group_names = [str(c) for c in groups.categories]
+        group_codes = groups.codes
+    else:
+        group_names = ["All cells"]
+        group_codes = np.zeros(len(expression.cells), dtype=np.int8)
+    group_positions = [np.flatnonzero(group_codes == code) for code in range(len(group_names))]
+
+    palette = px.colors.qualitative.Plotly
+    rng = np.random.default_rng(settings.violin_sampling_seed)
+    width = 0.8 / len(group_names)
+    boxes_x, boxes_y, medians_x, medians_y = [], [], [], []
+    outliers = {name: ([], []) for name in group_names}
+    violin_figure = go.Figure()
+    for i, gene in enumerate(genes):
+        label = gene_labels.get(gene, gene) if gene_labels else gene
+        gene_values = expression.dense_rows([gene])[0]  # One gene at a time, like generate_boxplot
+        for j, (name, positions) in enumerate(zip(group_names, group_positions, strict=True)):
+            if len(positions) == 0:
+                continue
+            values = gene_values[positions]
+            summary = _violin_summary(values, n_points)
+            center = i - 0.4 + width * (j + 0.5)
+            half = summary["density"] * width * 0.45
+            violin_figure.add_trace(
+                go.Scatter(
+                    x=np.concatenate([center + half, (center - half)[::-1]]),
+                    y=np.concatenate([summary["grid"], summary["grid"][::-1]]),
+                    fill="toself",
+                    mode="lines",
+                    line={"color": palette[j % len(palette)], "width": 1},
+                    name=name,
+                    legendgroup=name,
+                    showlegend=i == 0 and len(group_names) > 1,
+                    hoveron="fills",
+                    hoverinfo="text",
+                    text=f"{label} · {name}<br>n = {summary['n']:,}<br>median = {summary['median']:.3g}<br>"
+                    f"q1 = {summary['q1']:.3g}, q3 = {summary['q3']:.3g}",
+                )
+            )
+            boxes_x += [center, center, None]
+            boxes_y += [summary["q1"], summary["q3"], None]
+            medians_x.append(center)
+            medians_y.append(summary["median"])
+
+            low, high = summary["fences"]
+            beyond = values[(values < low) | (values > high)]
+            if len(beyond) > max_outliers:
+                beyond = rng.choice(beyond, max_outliers, replace=False)
+            outliers[name][0].extend(center + rng.uniform(-width * 0.2, width * 0.2, len(beyond)))
+            outliers[name][1].extend(beyond)
+
+    for j, (name, (x, y)) in enumerate(outliers.items()):
+        if x:
+            violin_figure.add_trace(
+                go.Scattergl(
+                    x=x,
+                    y=y,
+                    mode="markers",
+                    marker={"color": palette[j % len(palette)], "size": 3, "opacity": 0.6},
+                    name=name,
+                    legendgroup=name,
+                    showlegend=False,
+                    hoverinfo="y",
+                )
+            )
+    violin_figure.add_trace(go.Scatter(x=boxes_x, y=boxes_y, mode="lines", line={"color": "black", "width": 4}, hoverinfo="skip", showlegend=False))
+    violin_figure.add_trace(go.Scatter(x=medians_x, y=medians_y, mode="markers", marker={"color": "white", "size": 5, "line": {"color": "black", "width": 1}}, hoverinfo="skip", showlegend=False))
+
+    violin_figure.update_layout(
+        title="Violin Plot (summary)",
+        xaxis={"title": "Gene", "tickvals": list(range(len(genes))), "ticktext": [gene_labels.get(g, g) if gene_labels else g for g in genes]},
+        yaxis_title="Expression",
+        legend_title_text=shape_column if len(group_names) > 1 else None,
+    )
+    return violin_figure
+# -------------------------------------------------------------------
+
+
 # -------------------------------------------------------------------
 # Helper to scan data directory for allowed files
 def scan_files(dir_path: Path) -> list[str]:
@@ -370,42 +1094,66 @@ def parse_upload(contents: str, filename: str):
 
 
 # -------------------------------------------------------------------
-# Ensure that selected cells are in the current data, and that the resulting matrix isn't too large to handle
-def validate_selected_cells(selected_cells: list[str], all_cells: list[str], max_cells: int = settings.max_cells) -> tuple[list[str], dbc.Alert | None]:
-    # Check if all selected cells are in the current data
-    all_cells_set = set(all_cells)
-    if not all(cell in all_cells_set for cell in selected_cells):
-        raise ValueError("Some selected barcodes are not in the current data!")
-
-    # Check if the number of selected cells is within the limit
-    alert = None
-    if len(selected_cells) > max_cells:
-        selected_cells = selected_cells[:max_cells]  # Trim the list to the max allowed
-        alert = dbc.Alert(f"Warning: Too many barcodes selected. Downsampling to maximum {max_cells} barcodes.", color="danger", dismissable=True)
-
-    return list(selected_cells), alert
+# Proportional stratified sampling of cell positions, vectorized over category codes
+def stratified_sample(
+    positions: np.ndarray,
+    size: int,
+    strata: np.ndarray | pd.Series | None = None,
+    seed: int = settings.heatmap_sampling_seed,
+) -> np.ndarray:
+    """
+    Return a sorted, deterministic sample of size positions. With strata (integer codes
+    aligned with positions, -1 allowed), every stratum keeps its share of the sample
+    (largest remainder rounding), so no group is over- or under-represented.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    n = len(positions)
+    if n <= size:
+        return positions
+    rng = np.random.default_rng(seed)
+    if strata is None:
+        return positions[np.sort(rng.choice(n, size=size, replace=False))]
+
+    codes, _ = pd.factorize(strata)  # Dense 0..k-1 codes (categorical strata reuse theirs); missing values stay -1
+    codes = np.where(codes < 0, codes.max() + 1, codes)
+    counts = np.bincount(codes)
+    exact = counts * (size / n)
+    quota = np.floor(exact).astype(np.int64)
+    shortfall = size - int(quota.sum())
+    if shortfall:
+        quota[np.argsort(quota - exact, kind="stable")[:shortfall]] += 1
+
+    # Group by stratum (stable integer argsort is a linear radix sort), then draw each stratum's quota
+    order = np.argsort(codes, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    picks = [
+        order[start + rng.choice(count, size=take, replace=False)]
+        for start, count, take in zip(starts, counts, quota, strict=True)
+        if take
+    ]
+    return positions[np.sort(np.concatenate(picks))]
 # -------------------------------------------------------------------
 
 
 # -------------------------------------------------------------------
 def limit_heatmap_inputs(
     selected_genes: list[str] | None,
-    selected_cells: list[str],
+    selected_cells: np.ndarray,
     all_genes: list[str],
-    all_cells: list[str],
+    n_cells: int,
     max_genes: int = settings.max_heatmap_genes,
     max_cells: int = settings.max_heatmap_cells,
     seed: int = settings.heatmap_sampling_seed,
-) -> tuple[list[str], list[str], dbc.Alert | None]:
+    strata: np.ndarray | pd.Series | None = None,
+) -> tuple[list[str], np.ndarray, dbc.Alert | None]:
     genes = list(selected_genes) if selected_genes else list(all_genes)
-    cells = list(selected_cells)
+    cells = np.asarray(selected_cells, dtype=np.int64)
 
     all_genes_set = set(all_genes)
-    all_cells_set = set(all_cells)
 
     if not all(gene in all_genes_set for gene in genes):
         raise ValueError("Some selected genes are not in the current data!")
-    if not all(cell in all_cells_set for cell in cells):
+    if len(cells) and (cells.min() < 0 or cells.max() >= n_cells):
         raise ValueError("Some selected barcodes are not in the current data!")
 
     rng = np.random.default_rng(seed)
@@ -413,12 +1161,10 @@ def limit_heatmap_inputs(
     cells_were_sampled = len(cells) > max_cells
 
     if genes_were_sampled:
-        sampled_gene_indices = set(rng.choice(len(genes), size=max_genes, replace=False).tolist())
-        genes = [gene for idx, gene in enumerate(genes) if idx in sampled_gene_indices]
+        genes = [genes[idx] for idx in np.sort(rng.choice(len(genes), size=max_genes, replace=False))]
 
     if cells_were_sampled:
-        sampled_cell_indices = set(rng.choice(len(cells), size=max_cells, replace=False).tolist())
-        cells = [cell for idx, cell in enumerate(cells) if idx in sampled_cell_indices]
+        cells = stratified_sample(cells, max_cells, strata, seed=seed)  # Proportional per stratum when strata are given
 
     alert = None
     if genes_were_sampled and cells_were_sampled:
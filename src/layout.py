@@ -3,6 +3,8 @@ import os
 import dash_bootstrap_components as dbc
 from dash import dcc, html
 
+import settings
+
 FILTER_GRID_STYLE = {
     "display": "grid",
     "gridTemplateColumns": "minmax(0, 1fr) 2rem 2rem",
@@ -23,8 +25,9 @@ def get_layout(config_data):
         dcc.Store(id="filter-schema-store", data=[]),  # holds the filter schema, [] for none
         dcc.Store(id="shape-column-name"),  # holds column name for the current shape selection
         dcc.Store(id="config-store"),  # parsed config lives here
-        dcc.Store(id="active-plot-figures", data=[]),  # serialized active figures for export
+        dcc.Store(id="active-plot-figures"),  # opaque key for the server-side figures of the current plots (for export)
         dcc.Store(id="plot-status-store"),  # transient UI state for plot updates
+        dcc.Store(id="load-job-id"),  # id of the background dataset load currently being polled
         html.Div(
             id="file-controls",
             children=[
@@ -81,6 +84,8 @@ def get_layout(config_data):
                     },
                 ),
                 dcc.Interval(id="init", interval=50, n_intervals=0, max_intervals=1),  # populate once on load
+                dcc.Interval(id="load-poll", interval=500, disabled=True),  # polls a running dataset load
+                dcc.Interval(id="session-heartbeat", interval=settings.session_heartbeat_s * 1000),  # keeps this tab's server state alive
             ],
         ),
         # Dropdown for selecting the plot type
@@ -93,22 +98,50 @@ def get_layout(config_data):
                             id="plot-selector",
                             options=[
                                 {"label": "Boxplot", "value": "boxplot"},
+                                {"label": "Boxplot (summary, large selections)", "value": "boxplot_summary"},
                                 {"label": "UMAP Scatterplot", "value": "umap"},
+                                {"label": "UMAP Scatterplot (WebGL, large selections)", "value": "umap_gl"},
+                                {"label": "UMAP Density (binned, whole atlas)", "value": "umap_density"},
                                 {"label": "Violin Plot", "value": "violin"},
+                                {"label": "Violin Plot (summary, large selections)", "value": "violin_summary"},
                                 {"label": "Heatmap", "value": "heatmap"},
+                                {"label": "Heatmap (pseudobulk, mean per group)", "value": "heatmap_pseudobulk"},
                             ],
                             value="umap",  # Default selection
                             clearable=False,  # Should never be empty. You must select one, or let the default ride.
                             disabled=True,  # Enable after file load
                             style={"flex": "1 1 560px", "minWidth": "280px"},
                         ),
+                        dcc.Checklist(
+                            id="heatmap-cluster",
+                            options=[
+                                {"label": " Cluster genes", "value": "rows"},
+                                {"label": " Cluster cells", "value": "columns"},
+                            ],
+                            value=[],  # Heatmaps keep the selection order unless clustering is switched on
+                            inline=True,
+                            inputStyle={"marginLeft": "0.5rem"},
+                            style={"whiteSpace": "nowrap"},
+                        ),
                     ],
                     style={"display": "flex", "alignItems": "center", "gap": "0.75rem", "flex": "1 1 520px", "minWidth": "340px"},
                 ),
                 html.Div(
                     [
                         dbc.Button("Gene Filter Panel", id="open-left-offcanvas", n_clicks=0, color="primary"),
-                        dbc.Button("Export Plot SVG", id="download-svg-btn", n_clicks=0, color="primary"),
+                        dcc.Dropdown(
+                            id="export-formats",
+                            options=[
+                                {"label": "SVG", "value": "svg"},
+                                {"label": "PNG", "value": "png"},
+                                {"label": "PDF", "value": "pdf"},
+                            ],
+                            value=["svg"],
+                            multi=True,
+                            clearable=False,
+                            style={"minWidth": "160px"},
+                        ),
+                        dbc.Button("Export Plot", id="download-svg-btn", n_clicks=0, color="primary"),
                         dbc.Button("Barcode Filter Panel", id="open-right-offcanvas", n_clicks=0, color="primary"),
                     ],
                     style={"display": "flex", "alignItems": "center", "gap": "0.5rem", "flexWrap": "wrap", "justifyContent": "flex-end"},
@@ -203,9 +236,10 @@ def build_left(config_data):
             html.Label("Select gene(s):", htmlFor="gene-selector"),
             dcc.Dropdown(
                 id="gene-selector",
-                options=[],  # Populated dynamically
+                options=[],  # Populated dynamically: the server sends the matches for what is typed
                 multi=True,
-                placeholder="Select genes to display...",
+                placeholder="Type a gene symbol or ID...",
+                search_order="original",  # Keep the server's ranking (exact, prefix, then substring matches)
                 value=config_data.get("genes", []),
             ),
             html.Div(id="upload-status", style={"marginTop": "0.75rem"}),
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from threading import RLock
+from typing import Any
+
+from shared_records import SharedRecords
+
+logger = logging.getLogger(__name__)
+
+# Phases reported by data_loader.load_seurat_rds, with the share of the work done when each one starts
+LOAD_PHASES = {
+    "queued": 0,
+    "reading RDS": 5,
+    "extracting layer": 55,
+    "mapping symbols": 65,
+    "converting metadata": 75,
+    "writing cache": 85,
+    "reading cache": 20,  # Only phase of a load served from the dataset cache
+}
+
+
+class LoadCancelled(Exception):
+    """Raised inside a load job once it has been superseded or cancelled."""
+
+
+class LoadJobManager:
+    """
+    Run dataset loads on background threads so callbacks only start and poll them.
+
+    A job moves through the LOAD_PHASES and ends as "done" (result available),
+    "failed" (error message available) or, after cancel(), disappears. A cancelled
+    job stops at the next phase boundary; if it finishes anyway, on_discard is
+    called with its result so partially registered resources can be freed.
+
+    With shared records (multi-process serving), every job also keeps a record of its
+    status there, so any worker can report on it, cancel it or collect it. A worker
+    collecting another worker's job obtains the result itself through resolve (called
+    with the job's info), and the owner discards its copy once the record is gone.
+    """
+
+    _PUBLIC_FIELDS = ("status", "phase", "started", "error", "finished")
+
+    def __init__(self, shared: SharedRecords | None = None, resolve: Callable[[dict[str, Any]], Any] | None = None):
+        self._jobs: dict[str, dict[str, Any]] = {}
+        self._lock = RLock()
+        self._shared = shared
+        self._resolve = resolve
+
+    def _publish(self, job_id: str, job: dict[str, Any]) -> None:
+        if self._shared is not None:
+            self._shared.write("job", job_id, {k: job[k] for k in (*self._PUBLIC_FIELDS, "info")})
+
+    def _cancelled(self, job_id: str, job: dict[str, Any]) -> bool:
+        """Whether the job was cancelled here or, per its shared record, by another worker (remembered once seen)."""
+        if job["cancelled"].is_set():
+            return True
+        if self._shared is None:
+            return False
+        record = self._shared.read("job", job_id)
+        if record is None or record["status"] == "cancelled":
+            job["cancelled"].set()
+            return True
+        return False
+
+    def start(
+        self,
+        load: Callable[[Callable[[str], None]], Any],
+        on_discard: Callable[[Any], None] | None = None,
+        **info: Any,
+    ) -> str:
+        job_id = str(uuid.uuid4())
+        job = {
+            "status": "running",
+            "phase": "queued",
+            "started": time.time(),
+            "result": None,
+            "error": None,
+            "finished": None,
+            "cancelled": threading.Event(),
+            "on_discard": on_discard,
+            "info": info,
+            **info,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._publish(job_id, job)
+
+        def progress(phase: str) -> None:
+            # Called at every phase boundary, and repeatedly with the same phase while waiting on
+            # another session's load of the dataset: the shared record is only read on a new phase
+            if job["cancelled"].is_set() or (phase != job["phase"] and self._cancelled(job_id, job)):
+                raise LoadCancelled(job_id)
+            if phase != job["phase"]:
+                with self._lock:
+                    job["phase"] = phase
+                    self._publish(job_id, job)
+
+        def run() -> None:
+            try:
+                result = load(progress)
+            except LoadCancelled:
+                logger.info(f"Load job {job_id} cancelled during {job['phase']}")
+                with self._lock:
+                    self._jobs.pop(job_id, None)  # Already gone unless it was cancelled by another worker
+                if self._shared is not None:
+                    self._shared.delete("job", job_id)
+                return
+            except Exception as e:
+                logger.exception(f"Load job {job_id} failed")
+                with self._lock:
+                    job.update(status="failed", error=str(e), finished=time.time())
+                    self._publish(job_id, job)
+                return
+
+            with self._lock:
+                discard = self._cancelled(job_id, job)
+                if discard:
+                    self._jobs.pop(job_id, None)
+                else:
+                    job.update(status="done", phase="done", result=result, finished=time.time())
+                    self._publish(job_id, job)
+            if discard and on_discard is not None:
+                on_discard(result)
+
+        threading.Thread(target=run, name=f"load-{job_id[:8]}", daemon=True).start()
+        return job_id
+
+    def status(self, job_id: str | None) -> dict[str, Any] | None:
+        """Return a snapshot of the job (without its result), or None if unknown."""
+        if not job_id:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                snapshot = {k: v for k, v in job.items() if k not in ("result", "cancelled", "on_discard", "info")}
+        if job is None:
+            record = self._shared.read("job", job_id) if self._shared is not None else None
+            if record is None or record["status"] == "cancelled":
+                return None
+            snapshot = {**record["info"], **{k: record[k] for k in self._PUBLIC_FIELDS}}
+        snapshot["percent"] = 100 if snapshot["status"] == "done" else LOAD_PHASES.get(snapshot["phase"], 0)
+        snapshot["elapsed"] = time.time() - snapshot["started"]
+        return snapshot
+
+    def pop_result(self, job_id: str | None) -> Any:
+        """Remove a finished job and hand its result to the caller (None if not done)."""
+        if not job_id:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job["status"] == "running":
+                    return None
+                del self._jobs[job_id]
+                if self._shared is not None:
+                    self._shared.delete("job", job_id)
+                return job["result"]
+        if self._shared is None:
+            return None
+        record = self._shared.read("job", job_id)  # Started by another worker
+        if record is None or record["status"] != "done" or self._resolve is None:
+            if record is not None and record["status"] == "failed":
+                self._shared.delete("job", job_id)
+            return None
+        self._shared.delete("job", job_id)  # Tells the owner to discard its copy
+        return self._resolve(record["info"])
+
+    def cancel(self, job_id: str | None) -> None:
+        """Cancel a running job, or discard the result of a finished one nobody collected."""
+        if not job_id:
+            return
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                if self._shared is not None:
+                    record = self._shared.read("job", job_id)
+                    if record is not None:  # The owner notices at its next phase, or in expire()
+                        self._shared.write("job", job_id, {**record, "status": "cancelled"})
+                return
+            if self._shared is not None:
+                self._shared.delete("job", job_id)
+            job["cancelled"].set()
+            finished = job["status"] == "done"
+        if finished and job["on_discard"] is not None:
+            job["on_discard"](job["result"])
+
+    def expire(self, ttl_seconds: float) -> int:
+        """
+        Discard finished jobs nobody collected within ttl_seconds (e.g. the tab was closed
+        mid-load), and those another worker collected or cancelled.
+        """
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            stale = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job["finished"] is not None
+                and (job["finished"] < cutoff or (job["status"] == "done" and self._cancelled(job_id, job)))
+            ]
+        for job_id in stale:
+            self.cancel(job_id)
+        return len(stale)
+
+    def snapshot(self) -> dict[str, int]:
+        """Number of jobs per status."""
+        with self._lock:
+            counts: dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
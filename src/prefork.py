@@ -0,0 +1,125 @@
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+from werkzeug.serving import make_server
+
+import settings
+from callbacks import acquire_dataset, start_state_reaper
+from dataset_cache import dataset_cache_key
+from r_workers import warm_dataset_caches
+from shared_records import SharedRecords
+
+logger = logging.getLogger(__name__)
+
+
+def enable_shared_state(app) -> SharedRecords:
+    """
+    Give the app a private directory for session state shared by its worker processes.
+    Must run before register_callbacks(), which picks it up from app.server. Worker
+    processes run R in R worker processes of their own (at least one), never in the R
+    they inherit from the parent.
+    """
+    app.server.shared_records = SharedRecords(tempfile.mkdtemp(prefix="datascope-state-"))
+    app.server.r_workers = max(settings.R_WORKERS, 1)
+    return app.server.shared_records
+
+
+def resolve_preload_paths(rel_paths: list[str], data_dir: str | os.PathLike[str]) -> list[Path]:
+    """Absolute paths of the datasets to preload; like the file picker, only files below data_dir."""
+    data_dir = Path(data_dir).resolve()
+    paths = []
+    for rel_path in rel_paths:
+        abs_path = (data_dir / rel_path).resolve()
+        if not abs_path.is_relative_to(data_dir):
+            raise ValueError(f"Invalid preload path - {abs_path}")
+        paths.append(abs_path)
+    return paths
+
+
+def preload_datasets(app, paths: list[Path]) -> None:
+    """Load datasets into this process's registry and keep a reference to each, so they are never evicted."""
+    r_workers = getattr(app.server, "r_workers", None)
+    for abs_path in paths:
+        dataset_id = dataset_cache_key(abs_path, settings.DEFAULT_ASSAY, settings.DEFAULT_LAYER)
+        acquire_dataset(app.server.datasets, dataset_id, abs_path, r_workers=r_workers)  # Never released: pinned for the process's lifetime
+        logger.info(f"Preloaded {abs_path}")
+
+
+def _serve_worker(app, sock: socket.socket, host: str, port: int, preload: list[Path]) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    start_state_reaper(app)  # Threads don't survive a fork; start them in each worker
+    try:
+        preload_datasets(app, preload)  # From the dataset cache the parent warmed: memory-mapped rows share the page cache
+    except Exception:
+        logger.exception(f"Worker {os.getpid()} could not preload every dataset; serving without the rest")
+    server = make_server(host, port, app.server, threaded=True, fd=sock.fileno())
+    logger.info(f"Worker {os.getpid()} serving on {host}:{port}")
+    server.serve_forever()
+
+
+def _spawn_worker(app, sock: socket.socket, host: str, port: int, preload: list[Path]) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _serve_worker(app, sock, host, port, preload)
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} failed")
+        finally:
+            os._exit(1)
+    return pid
+
+
+def serve_prefork(app, host: str, port: int, workers: int, preload: list[Path] | None = None) -> None:
+    """
+    Serve the app from `workers` forked processes accepting on one listening socket. The
+    parent only supervises: it replaces workers that die and stops them all on SIGTERM or
+    SIGINT. It never loads datasets itself; the preload datasets are read once by a separate
+    R process to write their dataset caches, and every worker then opens them from the cache.
+    Call after register_callbacks(app, start_reaper=False), and before anything starts
+    threads or worker pools in this process.
+    """
+    if not hasattr(app.server, "shared_records"):
+        raise RuntimeError("Call enable_shared_state(app) before register_callbacks() to serve from several processes")
+    sock = socket.create_server((host, port), family=socket.AF_INET6 if ":" in host else socket.AF_INET, backlog=128)
+    sock.set_inheritable(True)
+    preload = list(preload or [])
+    warm_dataset_caches(preload, settings.DEFAULT_ASSAY, settings.DEFAULT_LAYER)  # On failure each worker loads them itself
+
+    children = {_spawn_worker(app, sock, host, port, preload) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"Serving on {host}:{port} with {workers} worker processes")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited ({os.waitstatus_to_exitcode(status)}); starting a replacement")
+            children.add(_spawn_worker(app, sock, host, port, preload))
+
+    sock.close()
+    shutil.rmtree(app.server.shared_records.directory, ignore_errors=True)
+    sys.exit(0)
@@ -0,0 +1,374 @@
+import logging
+import multiprocessing as mp
+from collections.abc import Callable
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock, RLock
+from typing import Any
+
+import numpy as np
+import scipy.sparse as sp
+
+import settings
+from expression_store import register_store
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCancelled(Exception):
+    """Raised inside a worker when the parent asks it to stop a load."""
+
+
+class RWorkerDied(RuntimeError):
+    """Raised when an R worker process exits (e.g. R crashed or ran out of memory) during a call."""
+
+
+# Exceptions re-raised in the parent with their own type; anything else arrives as a RuntimeError
+_RELAYED_ERRORS = {
+    cls.__name__: cls
+    for cls in (ValueError, KeyError, IndexError, TypeError, FileNotFoundError, PermissionError, MemoryError, NotImplementedError)
+}
+
+
+# -------------------------------------------------------------------
+# Expression blocks travel through one shared memory segment instead of the pipe
+def _to_shared(matrix: sp.csr_matrix) -> dict[str, Any]:
+    arrays = [
+        np.ascontiguousarray(matrix.data, dtype=np.float64),
+        np.ascontiguousarray(matrix.indices, dtype=np.int32),
+        np.ascontiguousarray(matrix.indptr, dtype=np.int64),
+    ]
+    shm = SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays), 1))
+    specs = []
+    offset = 0
+    for array in arrays:
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf, offset=offset)[:] = array
+        specs.append((array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    shm.close()
+    return {"name": shm.name, "shape": matrix.shape, "arrays": specs}
+
+
+def _from_shared(spec: dict[str, Any]) -> sp.csr_matrix:
+    try:
+        shm = SharedMemory(name=spec["name"])
+    except FileNotFoundError:
+        raise RuntimeError(f"Expression block {spec['name']} is gone") from None
+    try:
+        data, indices, indptr = (
+            np.ndarray(shape, np.dtype(dtype), buffer=shm.buf, offset=offset).copy()
+            for dtype, shape, offset in spec["arrays"]
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+    return sp.csr_matrix((data, indices, indptr), shape=tuple(spec["shape"]))
+
+
+def _unlink_shared(names: list[str]) -> None:
+    """Unlink segments the parent never picked up (it normally unlinks them itself)."""
+    for name in names:
+        try:
+            shm = SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+    names.clear()
+# -------------------------------------------------------------------
+
+
+# -------------------------------------------------------------------
+# Worker process: its own embedded R and .seurat_registry, driven over a pipe
+def _worker_main(conn) -> None:
+    settings.R_WORKERS = 0  # Workers run R in-process rather than starting pools of their own
+    import data_loader  # Initializes this worker's R
+
+    outstanding: list[str] = []  # Segment of the last subset; the parent has read it once it sends anything else
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            _unlink_shared(outstanding)
+            break
+        _unlink_shared(outstanding)
+        try:
+            if op == "load":
+
+                def progress(phase: str) -> None:
+                    conn.send(("progress", phase))
+                    if not conn.recv():
+                        raise WorkerCancelled(phase)
+
+                result = data_loader.load_seurat_rds(*args, progress=progress)
+                if result.get("expression_store"):
+                    # The parent opens the memory-mapped store itself; nothing stays pinned here
+                    data_loader.remove_seurat_handle(result["seurat_handle"])
+                conn.send(("result", result))
+            elif op == "subset":
+                matrix, rownames, colnames = data_loader.r_expression_subset(*args)
+                spec = _to_shared(matrix)
+                outstanding.append(spec["name"])
+                conn.send(("shared", (spec, rownames, colnames)))
+            elif op == "remove":
+                conn.send(("result", data_loader.remove_seurat_handle(*args)))
+            else:
+                raise ValueError(f"Unknown R worker operation: {op}")
+        except BaseException as e:
+            name = type(e).__name__
+            conn.send(("error", (name, e.args if name in _RELAYED_ERRORS else (), str(e))))
+# -------------------------------------------------------------------
+
+
+class RWorker:
+    """Parent-side proxy for one R worker process; calls are serialized per worker."""
+
+    def __init__(self, ctx, index: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name=f"datascope-r-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.index = index
+        self.handles: set[str] = set()
+        self.pending = 0
+        self.dead = False
+        self._lock = Lock()
+
+    def call(self, op: str, *args: Any, progress: Callable[[str], None] | None = None) -> Any:
+        """
+        Run op in the worker. progress is called with each phase the worker reports and, while
+        a phase runs, again every settings.r_worker_cancel_poll_s; raising from it stops the call. In the middle of
+        a phase (e.g. reading the RDS) that means stopping the worker, which is only done while it
+        holds no other dataset; otherwise the call stops at the next phase.
+        """
+        with self._lock:
+            if self.dead:
+                raise RWorkerDied(f"R worker {self.process.name} has exited")
+            interrupted = None
+            kind = payload = phase = None
+            try:
+                self.conn.send((op, args))
+                while True:
+                    if progress is not None and phase is not None and interrupted is None and not self.handles:
+                        while interrupted is None and not self.conn.poll(settings.r_worker_cancel_poll_s):
+                            try:
+                                progress(phase)
+                            except BaseException as e:
+                                interrupted = e
+                        if interrupted is not None:
+                            self.dead = True
+                            self.process.kill()  # The pool replaces it
+                            break
+                    kind, payload = self.conn.recv()
+                    if kind == "progress":
+                        phase = payload
+                        if interrupted is None and progress is not None:
+                            try:
+                                progress(payload)
+                            except BaseException as e:
+                                interrupted = e
+                        self.conn.send(interrupted is None)
+                        continue
+                    break
+            except (EOFError, OSError) as e:
+                self.dead = True
+                raise RWorkerDied(f"R worker {self.process.name} exited during {op} (exit code {self.process.exitcode})") from e
+            if kind == "shared":
+                # Read (and unlink) the block before the worker takes another call and cleans up after us
+                spec, rownames, colnames = payload
+                kind, payload = "result", (_from_shared(spec), rownames, colnames)
+        if interrupted is not None:
+            raise interrupted
+        if kind == "error":
+            name, args, message = payload
+            if name in _RELAYED_ERRORS:
+                raise _RELAYED_ERRORS[name](*args)
+            raise RuntimeError(f"R worker {self.process.name} failed: {name}: {message}")
+        return payload
+
+    def stop(self) -> None:
+        self.dead = True
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class RWorkerPool:
+    """
+    A fixed set of R worker processes. Each dataset loaded through R is pinned to the
+    worker that loaded it, so users working on datasets on different workers compute
+    in parallel. Datasets that end up memory-mapped are not pinned at all.
+
+    A worker that dies is replaced. Datasets it held are loaded again, from their file,
+    the next time they are used; until then the call that hit the dead worker fails.
+    """
+
+    def __init__(self, size: int):
+        self._ctx = mp.get_context("spawn")  # A fresh interpreter per worker; embedded R does not survive fork well
+        self._workers = [RWorker(self._ctx, i) for i in range(size)]
+        self._pinned: dict[str, RWorker] = {}
+        self._remote: dict[str, str] = {}  # Handle -> its name in the worker, which changes when it is reloaded
+        self._sources: dict[str, tuple[str, str, str, int, int]] = {}  # Handle -> (file_path, assay, layer, genes, cells) it was loaded from
+        self._lost: set[str] = set()  # Handles of a worker that died, reloaded on their next use
+        self._lock = RLock()
+        self._restore_lock = Lock()
+
+    def _call(self, worker: RWorker, op: str, *args: Any, progress: Callable[[str], None] | None = None) -> Any:
+        try:
+            return worker.call(op, *args, progress=progress)
+        finally:
+            if worker.dead:  # Died, or was stopped to cancel a load
+                self._replace(worker)
+
+    def _replace(self, worker: RWorker) -> None:
+        with self._lock:
+            if self._workers[worker.index] is not worker:
+                return  # Already replaced
+            for handle in worker.handles:
+                self._pinned.pop(handle, None)
+                self._lost.add(handle)
+            logger.warning(f"R worker {worker.process.name} exited; starting a replacement ({len(worker.handles)} datasets will reload on use)")
+            self._workers[worker.index] = RWorker(self._ctx, worker.index)
+        worker.stop()
+
+    def _pick(self) -> RWorker:
+        with self._lock:
+            worker = min(self._workers, key=lambda w: (w.pending, len(w.handles)))
+            worker.pending += 1
+            return worker
+
+    def _load(self, file_path, assay: str, layer: str, progress: Callable[[str], None] | None = None) -> tuple[RWorker, dict[str, Any]]:
+        worker = self._pick()
+        try:
+            return worker, self._call(worker, "load", str(file_path), assay, layer, progress=progress)
+        finally:
+            with self._lock:
+                worker.pending -= 1
+
+    def load(self, file_path, assay: str, layer: str, progress: Callable[[str], None] | None = None) -> dict[str, Any]:
+        worker, dataset = self._load(file_path, assay, layer, progress)
+        if dataset.get("expression_store"):
+            dataset["seurat_handle"] = register_store(file_path, dataset["expression_store"], dataset["genes"], dataset["cells"])
+        else:
+            handle = dataset["seurat_handle"]
+            with self._lock:
+                worker.handles.add(handle)
+                self._pinned[handle] = worker
+                self._remote[handle] = handle
+                self._sources[handle] = (str(file_path), assay, layer, len(dataset["genes"]), len(dataset["cells"]))
+        return dataset
+
+    def owns(self, handle: str | None) -> bool:
+        with self._lock:
+            return handle in self._pinned or handle in self._lost
+
+    def restore(self, handle: str | None) -> None:
+        """Load a dataset held by a worker that died again, keeping its handle; a no-op for any other handle."""
+        with self._lock:
+            if handle not in self._lost:
+                return
+        with self._restore_lock:
+            with self._lock:
+                if handle not in self._lost:
+                    return
+                file_path, assay, layer, n_genes, n_cells = self._sources[handle]
+            logger.info(f"Reloading {file_path} after its R worker died")
+            worker, dataset = self._load(file_path, assay, layer)
+            if (len(dataset["genes"]), len(dataset["cells"])) != (n_genes, n_cells):
+                if not dataset.get("expression_store"):
+                    self._call(worker, "remove", dataset["seurat_handle"])
+                raise RuntimeError(f"{file_path} changed since it was opened; open it again")
+            if dataset.get("expression_store"):
+                register_store(file_path, dataset["expression_store"], dataset["genes"], dataset["cells"], handle=handle)
+                with self._lock:
+                    self._lost.discard(handle)
+                    self._remote.pop(handle, None)
+                    self._sources.pop(handle, None)
+                return
+            with self._lock:
+                self._lost.discard(handle)
+                worker.handles.add(handle)
+                self._pinned[handle] = worker
+                self._remote[handle] = dataset["seurat_handle"]
+
+    def subset(self, handle: str, genes: list[str] | None = None, cells: np.ndarray | None = None):
+        with self._lock:
+            worker = self._pinned.get(handle)
+            remote = self._remote.get(handle)
+        if worker is None:
+            raise RWorkerDied(f"The R worker holding {handle} has exited")
+        return self._call(worker, "subset", remote, genes, cells)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {"worker": w.process.name, "alive": w.process.is_alive(), "handles": sorted(w.handles), "pending": w.pending}
+                for w in self._workers
+            ]
+
+    def remove(self, handle: str) -> bool:
+        with self._lock:
+            self._sources.pop(handle, None)
+            remote = self._remote.pop(handle, None)
+            if handle in self._lost:
+                self._lost.discard(handle)
+                return True  # Died with its worker
+            worker = self._pinned.pop(handle, None)
+            if worker is None:
+                return False
+            worker.handles.discard(handle)
+        try:
+            return bool(self._call(worker, "remove", remote))
+        except RWorkerDied:
+            return True
+
+
+_pool: RWorkerPool | None = None
+_pool_lock = Lock()
+
+
+def get_r_pool(size: int | None = None) -> RWorkerPool | None:
+    """
+    Return the process-wide worker pool, starting it with size workers (default settings.R_WORKERS)
+    on first use, or None when R runs embedded. Once started, the pool is returned whatever size asks.
+    """
+    global _pool
+    size = settings.R_WORKERS if size is None else size
+    with _pool_lock:
+        if _pool is None and size > 0:
+            logger.info(f"Starting {size} R worker processes")
+            _pool = RWorkerPool(size)
+        return _pool
+
+
+def _warm_caches_main(file_paths: list[str], assay: str, layer: str) -> None:
+    settings.R_WORKERS = 0
+    import data_loader
+
+    for file_path in file_paths:
+        data_loader.load_seurat_rds(file_path, assay, layer)  # Writes the dataset cache on a miss
+
+
+def warm_dataset_caches(file_paths: list[str], assay: str, layer: str) -> bool:
+    """
+    Load file_paths once in a separate R process so their dataset caches exist, without running
+    R in this process (e.g. before forking server processes that then open the caches
+    memory-mapped). Returns False if the caches are disabled or the process failed.
+    """
+    if not file_paths or not settings.DATASET_CACHE_ENABLED:
+        return False
+    process = mp.get_context("spawn").Process(
+        target=_warm_caches_main, args=([str(p) for p in file_paths], assay, layer), name="datascope-r-preload"
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        logger.warning(f"Writing the dataset caches of {len(file_paths)} preloaded datasets failed (exit code {process.exitcode})")
+    return process.exitcode == 0
+
+
+def r_pool_snapshot() -> list[dict[str, Any]] | None:
+    """Worker status of the pool if it has been started (never starts it)."""
+    with _pool_lock:
+        pool = _pool
+    return pool.snapshot() if pool is not None else None
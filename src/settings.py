@@ -6,17 +6,49 @@ DEFAULT_IP = os.getenv("DATASCOPE_IP", "127.0.0.1")
 DEFAULT_PORT = int(os.getenv("DATASCOPE_PORT", 8050))
 DEFAULT_DEBUG = os.getenv("DATASCOPE_DEBUG", "True") == "True"
 DEFAULT_RDS_PATH = os.getenv("DATASCOPE_RDS_PATH", os.getcwd())  # Default RDS file path is current working directory
+DEFAULT_WORKERS = int(os.getenv("DATASCOPE_WORKERS", 1))  # Server processes; more than 1 serves pre-forked (see prefork.py)
+DEFAULT_PRELOAD = os.getenv("DATASCOPE_PRELOAD", "")  # Datasets (relative to the RDS path, os.pathsep-separated) loaded at startup
 
 # Set a default token if not provided via environment variable (not recommended for production)
 DATASCOPE_TOKEN = os.environ.get("DATASCOPE_TOKEN", secrets.token_hex(32))  # 64-character hex string (256 bits)
 
+# Seurat assay and layer read by the loader
+DEFAULT_ASSAY = "SCT"
+DEFAULT_LAYER = "data"
+
+# Persistent dataset cache (set DATASCOPE_CACHE_DIR to keep it outside the data directory)
+DATASET_CACHE_ENABLED = os.getenv("DATASCOPE_DATASET_CACHE", "True") == "True"
+DATASET_CACHE_DIR = os.getenv("DATASCOPE_CACHE_DIR")  # None means a .datascope_cache folder next to each dataset
+SYMBOL_CACHE_DIR = os.getenv("DATASCOPE_SYMBOL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "datascope"))  # Ensembl-to-symbol tables
+DATASET_MEMORY_BUDGET_MB = int(os.getenv("DATASCOPE_MEMORY_BUDGET_MB", 8192))  # Idle datasets are evicted beyond this
+R_WORKERS = int(os.getenv("DATASCOPE_R_WORKERS", 0))  # R worker processes; 0 runs R embedded in the app process
+r_worker_cancel_poll_s = 0.5  # How often a load running in an R worker checks whether it was cancelled
+EXPRESSION_CACHE_MB = int(os.getenv("DATASCOPE_EXPRESSION_CACHE_MB", 1024))  # In-process cache of whole gene rows
+FIGURE_CACHE_MB = int(os.getenv("DATASCOPE_FIGURE_CACHE_MB", 256))  # In-process cache of built plots (each server process has its own)
+EXPRESSION_BACKEND = os.getenv("DATASCOPE_EXPRESSION_BACKEND", "mmap")  # "mmap" (cached gene rows on disk) or "r"
+EXPORT_WORKERS = int(os.getenv("DATASCOPE_EXPORT_WORKERS", 2))  # Plot export renderer processes; 0 renders in-process
+SESSION_TTL_MIN = float(os.getenv("DATASCOPE_SESSION_TTL_MIN", 60))  # Session state (and idle datasets) unused this long is freed
+session_heartbeat_s = 60  # Open tabs mark their session state as in use this often
+state_reaper_interval_s = 60  # How often expired session state is looked for
+
 # Other Settings
 RDS_ALLOWED_EXT = {".rds", ".rda", ".rdata"}  # Allowed file extensions
 
 max_features = 60  # Maximum number of features to plot at once (in violin plots, etc.)
+gene_search_results = 50  # Gene selector options sent per search (plus the selected genes)
 max_ticks_x = 100  # Maximum number of ticks to show on x-axis (e.g. for heatmap plots with many categories)
 max_ticks_y = 50  # Maximum number of ticks to show on y-axis (e.g. for heatmap plots with many genes)
-max_cells = 2000  # Maximum number of cells to allow for plotting (performance issues and werkzeug timeouts)
 max_heatmap_cells = 1000  # Maximum number of cells to display in a heatmap
 max_heatmap_genes = 500  # Maximum number of genes to display in a heatmap
 heatmap_sampling_seed = 42  # Fixed seed for deterministic heatmap downsampling
+heatmap_cluster_cache_entries = 64  # Clustered heatmap leaf orders remembered across re-renders
+figure_cache_entries = 32  # Built plots remembered per process, so revisiting a plot is instant
+max_umap_points = int(os.getenv("DATASCOPE_MAX_UMAP_POINTS", 100_000))  # WebGL UMAP decimates selections above this
+umap_decimation_bins = 256  # Grid resolution per axis for density-preserving UMAP decimation
+umap_sampling_seed = 42  # Fixed seed for deterministic UMAP decimation
+violin_kde_points = 128  # Grid points per KDE curve in summary violin plots
+violin_max_outliers = 200  # Sampled points beyond the fences shown per violin in summary violin plots
+violin_sampling_seed = 42  # Fixed seed for deterministic outlier sampling
+umap_density_bins = 200  # Grid resolution per axis of the binned (density) UMAP view
+cache_write_block_genes = 2000  # Genes copied from R per block when writing the dataset cache
+max_dense_mb = 5000  # Maximum size (MB) of an expression block we are willing to densify for plotting
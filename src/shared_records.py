@@ -0,0 +1,76 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any
+
+
+class SharedRecords:
+    """
+    Small pickled records in a directory shared by the worker processes of one server
+    (see prefork.py), so state created by one worker can be picked up by another.
+    Keys are the opaque uuid4 strings the browser holds; anything else is ignored.
+    Writes are atomic (temporary file plus rename) and a record's mtime is its last use.
+    """
+
+    def __init__(self, directory: str | os.PathLike[str]):
+        self.directory = Path(directory)
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def _path(self, kind: str, key: str | None) -> Path | None:
+        try:
+            key = str(uuid.UUID(str(key)))  # Never build paths from anything but a uuid
+        except ValueError:
+            return None
+        return self.directory / f"{kind}-{key}.pkl"
+
+    def write(self, kind: str, key: str, value: Any) -> None:
+        path = self._path(kind, key)
+        if path is None:
+            return
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def read(self, kind: str, key: str | None) -> Any:
+        path = self._path(kind, key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, kind: str, key: str | None) -> None:
+        path = self._path(kind, key)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def touch(self, kind: str, key: str | None) -> None:
+        path = self._path(kind, key)
+        if path is not None:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def exists(self, kind: str, key: str | None) -> bool:
+        path = self._path(kind, key)
+        return path is not None and path.exists()
+
+    def expire(self, ttl_seconds: float) -> int:
+        """Delete records unused for ttl_seconds; return how many."""
+        cutoff = time.time() - ttl_seconds
+        removed = 0
+        for path in self.directory.glob("*.pkl"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
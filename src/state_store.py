@@ -1,41 +1,174 @@
-from threading import RLock
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from threading import Lock, RLock
 from typing import Any
 
+from shared_records import SharedRecords
+
 
 class AppStateStore:
-    def __init__(self):
+    """
+    Server-side session state behind the opaque keys held in the browser. Every entry
+    remembers when it was last used, so state of closed tabs can be expired (see expire()).
+
+    With shared records (multi-process serving), every entry is also written there as a
+    small record of how to rebuild it: datasets as {dataset_id, file_path}, selections as
+    their filters and figures as their plot inputs. A worker that misses a key locally
+    rebuilds the entry from its record through the resolver set for its kind.
+    """
+
+    def __init__(self, shared: SharedRecords | None = None):
         self._datasets: dict[str, dict[str, Any]] = {}
         self._selections: dict[str, dict[str, Any]] = {}
+        self._figures: dict[str, list[dict[str, Any]]] = {}
+        self._last_access: dict[str, float] = {}  # Keys are uuid4 strings, unique across the three kinds
         self._lock = RLock()
+        self._shared = shared
+        self._resolvers: dict[str, Callable[[dict[str, Any]], Any]] = {}
+        self._resolving: dict[str, list] = {}  # key -> [lock, users]: one resolution per key at a time
 
-    def get_dataset(self, key: str | None) -> dict[str, Any] | None:
+    def set_resolver(self, kind: str, resolve: Callable[[dict[str, Any]], Any]) -> None:
+        """
+        How to rebuild an entry of kind ("dataset", "selection" or "figures") in this process
+        from its shared record; resolve may return None if that is no longer possible.
+        A dataset resolver takes a reference to the dataset.
+        """
+        self._resolvers[kind] = resolve
+
+    def _touch(self, key: str, value: Any) -> Any:
+        if value is not None:
+            self._last_access[key] = time.monotonic()
+        return value
+
+    @contextmanager
+    def _resolving_key(self, key: str) -> Iterator[None]:
+        """Hold the lock of key, so concurrent misses of one key resolve it once without blocking other keys."""
+        with self._lock:
+            flight = self._resolving.setdefault(key, [Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self._resolving[key]
+
+    def _get(self, table: dict[str, Any], kind: str, key: str | None) -> Any:
         if not key:
             return None
         with self._lock:
-            return self._datasets.get(key)
+            value = self._touch(key, table.get(key))
+        resolve = self._resolvers.get(kind)
+        if value is not None or self._shared is None or resolve is None:
+            return value
+        record = self._shared.read(kind, key)
+        if record is None:
+            return None
+        with self._resolving_key(key):  # Resolving figures resolves their dataset and selection under their own keys
+            with self._lock:
+                value = table.get(key)
+            if value is None:
+                value = resolve(record)
+                if value is not None:
+                    with self._lock:
+                        table[key] = self._touch(key, value)
+        return value
 
-    def put_dataset(self, key: str, value: dict[str, Any]) -> None:
+    def _put(self, table: dict[str, Any], kind: str, key: str, value: Any, record: dict[str, Any]) -> None:
+        if self._shared is not None:
+            self._shared.write(kind, key, record)  # First: expire() drops entries without a record
         with self._lock:
-            self._datasets[key] = value
+            table[key] = self._touch(key, value)
 
-    def delete_dataset(self, key: str | None) -> dict[str, Any] | None:
+    def _delete(self, table: dict[str, Any], kind: str, key: str | None) -> Any:
         if not key:
             return None
+        if self._shared is not None:
+            self._shared.delete(kind, key)
         with self._lock:
-            return self._datasets.pop(key, None)
+            self._last_access.pop(key, None)
+            return table.pop(key, None)
+
+    def get_dataset(self, key: str | None) -> dict[str, Any] | None:
+        return self._get(self._datasets, "dataset", key)
+
+    def put_dataset(self, key: str, value: dict[str, Any]) -> None:
+        self._put(self._datasets, "dataset", key, value, record={"dataset_id": value["dataset_id"], "file_path": value["file_path"]})
+
+    def delete_dataset(self, key: str | None) -> dict[str, Any] | None:
+        return self._delete(self._datasets, "dataset", key)
 
     def get_selection(self, key: str | None) -> dict[str, Any] | None:
-        if not key:
-            return None
+        return self._get(self._selections, "selection", key)
+
+    def put_selection(self, key: str, value: dict[str, Any], record: dict[str, Any]) -> None:
+        """Store a selection; record holds what it was computed from (see set_resolver)."""
+        self._put(self._selections, "selection", key, value, record)
+
+    def delete_selection(self, key: str | None) -> dict[str, Any] | None:
+        return self._delete(self._selections, "selection", key)
+
+    def get_figures(self, key: str | None) -> list[dict[str, Any]] | None:
+        return self._get(self._figures, "figures", key)
+
+    def put_figures(self, key: str, value: list[dict[str, Any]], record: dict[str, Any]) -> None:
+        """Store built figures; record holds the plot inputs they were built from (see set_resolver)."""
+        self._put(self._figures, "figures", key, value, record)
+
+    def delete_figures(self, key: str | None) -> list[dict[str, Any]] | None:
+        return self._delete(self._figures, "figures", key)
+
+    def touch(self, *keys: str | None) -> None:
+        """Mark entries as in use (e.g. on a heartbeat from an open tab) without reading them."""
         with self._lock:
-            return self._selections.get(key)
+            for key in keys:
+                if key in self._last_access:
+                    self._last_access[key] = time.monotonic()
+        if self._shared is not None:
+            for key in keys:
+                for kind in ("dataset", "selection", "figures"):
+                    self._shared.touch(kind, key)
 
-    def put_selection(self, key: str, value: dict[str, Any]) -> None:
+    def expire(self, ttl_seconds: float) -> list[dict[str, Any]]:
+        """
+        Drop every entry unused for ttl_seconds, and with shared records every entry whose record
+        is gone (deleted or expired by another process, e.g. the session replaced its dataset).
+        Return the dropped datasets so the caller can release them.
+        """
+        cutoff = time.monotonic() - ttl_seconds
+        if self._shared is not None:
+            self._shared.expire(ttl_seconds)
+            with self._lock:
+                resident = [
+                    (kind, key)
+                    for kind, table in (("dataset", self._datasets), ("selection", self._selections), ("figures", self._figures))
+                    for key in table
+                ]
+            orphaned = {key for kind, key in resident if not self._shared.exists(kind, key)}
+        else:
+            orphaned = set()
         with self._lock:
-            self._selections[key] = value
+            stale = [key for key, last in self._last_access.items() if last < cutoff or key in orphaned]
+            expired_datasets = []
+            for key in stale:
+                del self._last_access[key]
+                self._selections.pop(key, None)
+                self._figures.pop(key, None)
+                dataset = self._datasets.pop(key, None)
+                if dataset is not None:
+                    expired_datasets.append(dataset)
+        return expired_datasets
 
-    def delete_selection(self, key: str | None) -> dict[str, Any] | None:
-        if not key:
-            return None
+    def snapshot(self) -> dict[str, Any]:
+        """Counts of resident session entries and how long the oldest has been idle."""
+        now = time.monotonic()
         with self._lock:
-            return self._selections.pop(key, None)
+            return {
+                "datasets": len(self._datasets),
+                "selections": len(self._selections),
+                "figure_sets": len(self._figures),
+                "max_idle_seconds": round(max((now - last for last in self._last_access.values()), default=0.0), 1),
+            }
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app modules import each other as top-level modules (see src/cli.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from dataset_registry import DatasetRegistry
+
+
+def _registry(budget_bytes=1000):
+    evicted = []
+    return DatasetRegistry(budget_bytes, evict=lambda dataset: evicted.append(dataset["name"])), evicted
+
+
+def _loader(name, nbytes, calls, delay=0.0):
+    def load(progress):
+        calls.append(name)
+        progress("reading RDS")
+        time.sleep(delay)
+        return {"name": name, "matrix_bytes": nbytes}
+
+    return load
+
+
+def test_concurrent_acquires_share_one_load():
+    registry, _ = _registry()
+    calls, results = [], []
+    load = _loader("a", 10, calls, delay=0.2)
+    threads = [threading.Thread(target=lambda: results.append(registry.acquire("a", load))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["a"]
+    assert all(result is results[0] for result in results)
+    assert registry.snapshot()[0]["refs"] == 4
+
+
+def test_released_datasets_are_evicted_least_recently_used_first_when_over_budget():
+    registry, evicted = _registry(budget_bytes=250)
+    calls = []
+    for name in ("a", "b"):
+        registry.acquire(name, _loader(name, 100, calls))
+    registry.release("a")
+    registry.release("b")
+    assert evicted == []  # Within budget: idle datasets stay resident
+
+    registry.acquire("c", _loader("c", 100, calls))
+    assert evicted == ["a"]
+    registry.acquire("b", _loader("b", 100, calls))  # Still resident: no reload
+    assert calls == ["a", "b", "c"]
+
+
+def test_held_datasets_are_never_evicted():
+    registry, evicted = _registry(budget_bytes=150)
+    calls = []
+    registry.acquire("a", _loader("a", 100, calls))
+    registry.acquire("b", _loader("b", 100, calls))
+    assert evicted == []
+    registry.release("a")
+    assert evicted == ["a"]
+
+
+def test_expire_idle_only_unloads_unreferenced_datasets():
+    registry, evicted = _registry()
+    calls = []
+    registry.acquire("a", _loader("a", 10, calls))
+    registry.acquire("b", _loader("b", 10, calls))
+    registry.release("b")
+    assert registry.expire_idle(0) == 1
+    assert evicted == ["b"]
+    assert [entry["dataset_id"] for entry in registry.snapshot()] == ["a"]
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from filter_index import CellFilterIndex
+
+
+def _metadata(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    cluster = rng.choice(["a", "b", "c", "d", None], size=n)
+    return pd.DataFrame(
+        {
+            "cluster": pd.Categorical(cluster, categories=["a", "b", "c", "d", "unused"]),
+            "sample": rng.choice(["s1", "s2", "s3"], size=n).astype(object),  # Not categorical: falls back to isin
+            "batch": rng.integers(0, 4, size=n),
+        }
+    )
+
+
+def test_select_matches_pandas_isin():
+    metadata = _metadata()
+    index = CellFilterIndex(metadata)
+    cases = [
+        [],
+        [("cluster", ["a"])],
+        [("cluster", ["b", "d", "unused", "not a category"])],
+        [("cluster", ["a", "c"]), ("sample", ["s2"])],
+        [("cluster", ["c"]), ("batch", [0, 3]), ("sample", ["s1", "s3"])],
+        [("cluster", []), ("sample", ["s3"])],  # No values selected: no filter on that column
+    ]
+    for filters in cases:
+        expected = np.ones(len(metadata), dtype=bool)
+        for column, values in filters:
+            if values:
+                expected &= metadata[column].isin(values).to_numpy()
+        np.testing.assert_array_equal(index.select(filters), np.flatnonzero(expected))
+
+
+def test_missing_values_never_match():
+    metadata = _metadata()
+    selected = CellFilterIndex(metadata).select([("cluster", ["a", "b", "c", "d"])])
+    assert metadata["cluster"].iloc[selected].notna().all()
+    assert len(selected) == metadata["cluster"].notna().sum()
@@ -0,0 +1,32 @@
+from gene_index import GeneSearchIndex
+
+
+def _index():
+    genes = ["ENSG01", "ENSG02", "ENSG03", "ENSG04", "ENSG05", "ENSG06"]
+    symbols = {"ENSG01": "CD4", "ENSG02": "CD40", "ENSG03": "CD44", "ENSG04": "ACD4X", "ENSG05": "GAPDH", "ENSG06": "cd4"}
+    by_symbol: dict[str, list[str]] = {}
+    for gene, symbol in symbols.items():
+        by_symbol.setdefault(symbol.casefold(), []).append(gene)
+    return GeneSearchIndex(genes, symbols, by_symbol)
+
+
+def test_search_ranks_exact_then_prefix_then_substring():
+    assert _index().search("cd4", limit=10) == ["ENSG01", "ENSG06", "ENSG02", "ENSG03", "ENSG04"]
+
+
+def test_search_is_case_insensitive_and_matches_ids():
+    index = _index()
+    assert index.search("Gapdh", limit=10) == ["ENSG05"]
+    assert index.search("ensg05", limit=10) == ["ENSG05"]
+
+
+def test_search_respects_limit_and_empty_query():
+    index = _index()
+    assert index.search("cd4", limit=2) == ["ENSG01", "ENSG06"]
+    assert index.search("", limit=3) == ["ENSG01", "ENSG02", "ENSG03"]
+    assert index.search("nothing", limit=10) == []
+
+
+def test_options_search_text_covers_label_and_id():
+    [option] = _index().options(["ENSG03"])
+    assert option == {"label": "CD44", "value": "ENSG03", "search": "CD44 ENSG03"}
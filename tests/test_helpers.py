@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+from helpers import (
+    ExpressionSubset,
+    _violin_summary,
+    decimate_points,
+    fetch_expression_group_means_zscores,
+    generate_umap_density,
+    generate_violin_summary,
+    stratified_sample,
+)
+
+
+def test_decimate_points_every_point_in_its_own_bin():
+    x = np.arange(20, dtype=float)
+    keep = decimate_points(x, x, max_points=10)
+    assert 0 < len(keep) <= 10
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_decimate_points_bounded_when_occupied_bins_exceed_budget():
+    rng = np.random.default_rng(0)
+    for n, max_points in [(200_000, 1000), (500, 100)]:
+        keep = decimate_points(rng.normal(size=n), rng.normal(size=n), max_points=max_points)
+        assert 0 < len(keep) <= max_points
+        assert len(np.unique(keep)) == len(keep)
+
+
+def _expression(genes, values):
+    values = np.asarray(values, dtype=float)
+    return ExpressionSubset(sp.csr_matrix(values), list(genes), [f"cell{i}" for i in range(values.shape[1])])
+
+
+def test_violin_summary_skips_genes_missing_from_the_subset():
+    expression = _expression(["A", "C"], [[1, 2, 3, 4], [10, 20, 30, 40]])
+    metadata = pd.DataFrame(index=expression.cells)
+    fig = generate_violin_summary(expression, ["A", "B", "C"], metadata, None)
+    outlines = [trace for trace in fig.data if trace.fill == "toself"]
+    assert len(outlines) == 2
+    assert max(outlines[1].y) == 40  # C is drawn with its own values, not shifted into B's slot
+
+
+def test_violin_summary_constant_group_is_a_line_at_its_value():
+    summary = _violin_summary(np.full(5, 2.5), n_points=64)
+    assert np.all(summary["grid"] == 2.5)
+    assert summary["q1"] == summary["median"] == summary["q3"] == 2.5
+
+
+def test_umap_density_mean_ignores_missing_values_and_coordinates():
+    umap = pd.DataFrame({"UMAP_1": [0.0, 0.0, 1.0, np.nan], "UMAP_2": [0.0, 0.0, 1.0, 0.0]})
+    color = pd.Series([4.0, np.nan, 2.0, 100.0], name="score")
+    fig = generate_umap_density(umap, color, bins=2)
+    z = np.asarray(fig.data[0].z, dtype=float)
+    assert z[0, 0] == 4.0  # Not (4 + 0) / 2
+    assert z[1, 1] == 2.0
+    assert np.asarray(fig.data[0].customdata).sum() == 3  # The cell without coordinates is not binned
+
+
+def test_group_means_without_any_group_value_explains_why(monkeypatch):
+    import helpers
+
+    monkeypatch.setattr(helpers, "_expression_subset", lambda *args: pytest.fail("no expression should be fetched"))
+    groups = pd.Series(pd.Categorical([None, None], categories=["a"]), name="cluster")
+    with pytest.raises(ValueError, match="No selected cells have a value in cluster"):
+        fetch_expression_group_means_zscores("handle", ["A"], np.arange(2), groups)
+
+
+def test_stratified_sample_keeps_each_group_share():
+    positions = np.arange(10_000) * 3
+    strata = np.repeat(["a", "b", "c", None], [6000, 3000, 999, 1])
+    sample = stratified_sample(positions, 1000, strata)
+    assert len(sample) == 1000
+    assert np.all(np.diff(sample) > 0)
+    assert np.isin(sample, positions).all()
+    drawn = pd.Series(strata[np.searchsorted(positions, sample)]).value_counts(dropna=False)
+    assert drawn.to_dict() == {"a": 600, "b": 300, "c": 100}  # The lone missing cell loses on the rounding
+    np.testing.assert_array_equal(sample, stratified_sample(positions, 1000, strata))
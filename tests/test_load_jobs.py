@@ -0,0 +1,54 @@
+import threading
+import time
+
+from load_jobs import LoadJobManager
+from shared_records import SharedRecords
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_finished_job_hands_over_its_result_once():
+    jobs = LoadJobManager()
+    job_id = jobs.start(lambda progress: progress("reading RDS") or "dataset", path="a.rds")
+    _wait_for(lambda: jobs.status(job_id)["status"] == "done")
+    assert jobs.status(job_id)["percent"] == 100
+    assert jobs.pop_result(job_id) == "dataset"
+    assert jobs.status(job_id) is None
+
+
+def test_job_cancelled_by_another_worker_stops_and_discards(tmp_path):
+    shared = SharedRecords(tmp_path)
+    owner, other = LoadJobManager(shared), LoadJobManager(shared)
+    go = threading.Event()
+    discarded = []
+
+    def load(progress):
+        progress("reading RDS")
+        go.wait(5)
+        progress("extracting layer")  # Sees the cancellation here
+        return "dataset"
+
+    job_id = owner.start(load, on_discard=discarded.append)
+    _wait_for(lambda: (other.status(job_id) or {}).get("phase") == "reading RDS")
+    other.cancel(job_id)
+    go.set()
+    _wait_for(lambda: owner.snapshot() == {})
+    assert other.status(job_id) is None
+    assert discarded == []  # Stopped before it produced anything
+
+
+def test_another_worker_collects_a_finished_job_through_resolve(tmp_path):
+    shared = SharedRecords(tmp_path)
+    owner = LoadJobManager(shared)
+    other = LoadJobManager(shared, resolve=lambda info: f"resolved {info['dataset_id']}")
+    discarded = []
+    job_id = owner.start(lambda progress: "dataset", on_discard=discarded.append, dataset_id="abc")
+    _wait_for(lambda: (other.status(job_id) or {}).get("status") == "done")
+    assert other.pop_result(job_id) == "resolved abc"
+    assert owner.expire(3600) == 1  # The owner notices the record is gone and drops its copy
+    assert discarded == ["dataset"]
@@ -0,0 +1,79 @@
+import threading
+import time
+import uuid
+
+from shared_records import SharedRecords
+from state_store import AppStateStore
+
+
+def _stores(tmp_path):
+    return AppStateStore(SharedRecords(tmp_path)), AppStateStore(SharedRecords(tmp_path))
+
+
+def test_second_store_resolves_a_dataset_from_the_shared_record(tmp_path):
+    owner, other = _stores(tmp_path)
+    resolved = []
+    other.set_resolver("dataset", lambda record: resolved.append(record) or {**record, "resolved": True})
+    key = str(uuid.uuid4())
+    owner.put_dataset(key, {"dataset_id": "abc", "file_path": "/data/a.rds", "metadata": object()})
+
+    dataset = other.get_dataset(key)
+    assert dataset == {"dataset_id": "abc", "file_path": "/data/a.rds", "resolved": True}
+    assert other.get_dataset(key) is dataset  # Resolved once, then served locally
+    assert resolved == [{"dataset_id": "abc", "file_path": "/data/a.rds"}]
+
+
+def test_selection_resolves_through_its_dataset(tmp_path):
+    owner, other = _stores(tmp_path)
+    other.set_resolver("dataset", lambda record: dict(record))
+    other.set_resolver("selection", lambda record: {"filters": record["filters"], "dataset": other.get_dataset(record["dataset_key"])})
+    dataset_key, selection_key = str(uuid.uuid4()), str(uuid.uuid4())
+    owner.put_dataset(dataset_key, {"dataset_id": "abc", "file_path": "/data/a.rds"})
+    owner.put_selection(selection_key, {"cells": []}, {"dataset_key": dataset_key, "filters": [["cluster", ["1"]]]})
+
+    selection = other.get_selection(selection_key)
+    assert selection["dataset"]["dataset_id"] == "abc"
+    assert selection["filters"] == [["cluster", ["1"]]]
+
+
+def test_unknown_and_invalid_keys_resolve_to_none(tmp_path):
+    _, other = _stores(tmp_path)
+    other.set_resolver("dataset", lambda record: dict(record))
+    assert other.get_dataset(str(uuid.uuid4())) is None
+    assert other.get_dataset("../../etc/passwd") is None
+
+
+def test_a_slow_resolution_does_not_block_other_keys(tmp_path):
+    owner, other = _stores(tmp_path)
+    release = threading.Event()
+
+    def resolve(record):
+        if record["dataset_id"] == "slow":
+            release.wait(5)
+        return dict(record)
+
+    other.set_resolver("dataset", resolve)
+    slow_key, fast_key = str(uuid.uuid4()), str(uuid.uuid4())
+    owner.put_dataset(slow_key, {"dataset_id": "slow", "file_path": ""})
+    owner.put_dataset(fast_key, {"dataset_id": "fast", "file_path": ""})
+    slow = threading.Thread(target=other.get_dataset, args=(slow_key,))
+    slow.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    assert other.get_dataset(fast_key)["dataset_id"] == "fast"
+    assert time.monotonic() - start < 1
+    release.set()
+    slow.join()
+
+
+def test_expire_drops_datasets_whose_record_was_deleted(tmp_path):
+    owner, other = _stores(tmp_path)
+    other.set_resolver("dataset", lambda record: dict(record))
+    key = str(uuid.uuid4())
+    owner.put_dataset(key, {"dataset_id": "abc", "file_path": ""})
+    other.get_dataset(key)
+    assert other.expire(3600) == []
+
+    owner.delete_dataset(key)
+    assert [dataset["dataset_id"] for dataset in other.expire(3600)] == ["abc"]
+    assert other.snapshot()["datasets"] == 0